@@ -0,0 +1,54 @@
+"""
+Measures the memory retained per live Conversation, the way the bot keeps them
+in the conversation registry: a system message, a user message and the assistant's
+reply, with the payload built once (as it is for every generation).
+
+Usage:
+    python -m benchmarks.conversation_memory [--counts 1000 10000 100000]
+"""
+from __future__ import annotations
+
+import argparse
+import gc
+import tracemalloc
+
+from dialogue.conversation import Conversation
+from dialogue.message import Message
+
+
+def build_conversation(index: int) -> Conversation:
+    conversation = Conversation()
+    conversation.add_message(Message("user", f"hey speeb, what do you think about message number {index}?"))
+    conversation.add_message(Message("assistant", f"Message number {index}? Honestly, it's a solid number. "
+                                                  f"Not my favourite, but I've seen worse."))
+    conversation.to_list_dict()
+
+    return conversation
+
+
+def bytes_per_conversation(count: int) -> float:
+    gc.collect()
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+
+    conversations = [build_conversation(index) for index in range(count)]
+
+    gc.collect()
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    assert len(conversations) == count
+    return (after - before) / count
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Measure memory retained per conversation.")
+    parser.add_argument("--counts", type=int, nargs="+", default=[1000, 10000, 100000])
+    args = parser.parse_args()
+
+    for count in args.counts:
+        print(f"{count:>8} conversations: {bytes_per_conversation(count):>8.0f} bytes per conversation")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,364 @@
+"""
+Offline end-to-end load test. Replays a synthetic trace of Discord messages
+through main.on_message, with every upstream API (OpenAI, Gemini, Brave Search,
+Genius and OpenWeatherMap) replaced by a local stand-in server (see
+stand_in_servers.py), and Discord replaced by fake messages and channels.
+
+The trace is replayed once per route (--web, --weather, --song, --artist,
+--logic and --none), then once with every route mixed together. For each phase,
+reports p50/p95/p99 end-to-end latency (from on_message being called until it
+returns, i.e. the reply is final), throughput, event loop lag and peak RSS.
+
+Messages arrive as a Poisson process at --rate messages per second, from
+--guilds guilds with --users users each. A --reply-ratio fraction of them reply
+to one of the bot's earlier replies, continuing that conversation.
+
+Usage:
+    python -m benchmarks.load_test [--messages 200] [--rate 20] [--routes web none]
+                                   [--profile openai=0.4:0.15:0:0.01] [--error-rate 0.01] [--cold-caches]
+
+Profiles are given as upstream=latency[:jitter[:error_rate[:chunk_interval]]], in seconds,
+for the upstreams openai, gemini, brave, weather and genius.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import contextlib
+import itertools
+import os
+import random
+import resource
+import sys
+import time
+import typing
+
+from benchmarks.stand_in_servers import DEFAULT_PROFILES
+from benchmarks.stand_in_servers import HANDLERS
+from benchmarks.stand_in_servers import LatencyProfile
+from benchmarks.stand_in_servers import QUESTIONS
+from benchmarks.stand_in_servers import ROUTES
+from benchmarks.stand_in_servers import StandInServer
+
+_ids = itertools.count(10 ** 17)
+
+
+class FakeAsset:
+    def __init__(self, url: str) -> None:
+        self.url = url
+
+
+class FakeUser:
+    def __init__(self, user_id: int, name: str, bot: bool = False) -> None:
+        self.id = user_id
+        self.name = name
+        self.bot = bot
+        self.avatar = FakeAsset(f"https://cdn.example.com/avatars/{user_id}.png")
+        self.activity = None
+        self.activities = ()
+        self.mention = f"<@{user_id}>"
+
+
+class FakeGuild:
+    def __init__(self, guild_id: int) -> None:
+        self.id = guild_id
+
+
+class FakeReference:
+    """Stands in for discord.MessageReference. The referenced message is always
+    served from the cache, as it would be for a recent reply to the bot."""
+
+    def __init__(self, message: FakeMessage) -> None:
+        self.message_id = message.id
+        self.resolved = None
+        self.cached_message = message
+
+
+class FakeChannel:
+    """Stands in for a text channel. Every REST call the bot makes through it
+    (sends, replies, edits and deletes) takes `latency` seconds."""
+
+    def __init__(self, guild: FakeGuild, latency: float) -> None:
+        self.id = next(_ids)
+        self.guild = guild
+        self.latency = latency
+        self.messages: dict[int, FakeMessage] = {}
+
+    async def send(self, content: str | None = None, embed: typing.Any = None) -> FakeMessage:
+        await asyncio.sleep(self.latency)
+        return self.add(FakeMessage(content or "", BOT_USER, self, embed=embed))
+
+    async def fetch_message(self, message_id: int) -> FakeMessage:
+        await asyncio.sleep(self.latency)
+        return self.messages[message_id]
+
+    @contextlib.asynccontextmanager
+    async def typing(self) -> typing.AsyncIterator[None]:
+        await asyncio.sleep(self.latency)
+        yield
+
+    def add(self, message: FakeMessage) -> FakeMessage:
+        self.messages[message.id] = message
+        return message
+
+
+class FakeMessage:
+    def __init__(self, content: str, author: FakeUser, channel: FakeChannel,
+                 reference: FakeReference | None = None, embed: typing.Any = None) -> None:
+        self.id = next(_ids)
+        self.content = content
+        self.author = author
+        self.channel = channel
+        self.guild = channel.guild
+        self.attachments = []
+        self.reference = reference
+        self.embed = embed
+        self.replies: list[FakeMessage] = []
+        self.deleted = False
+
+    async def reply(self, content: str | None = None, embed: typing.Any = None) -> FakeMessage:
+        await asyncio.sleep(self.channel.latency)
+        reply = self.channel.add(FakeMessage(content or "", BOT_USER, self.channel, FakeReference(self), embed))
+        self.replies.append(reply)
+
+        return reply
+
+    async def edit(self, content: str | None = None, embed: typing.Any = None) -> FakeMessage:
+        await asyncio.sleep(self.channel.latency)
+        if content is not None:
+            self.content = content
+        if embed is not None:
+            self.embed = embed
+
+        return self
+
+    async def delete(self) -> None:
+        await asyncio.sleep(self.channel.latency)
+        self.deleted = True
+
+
+BOT_USER = FakeUser(next(_ids), "Speebot", bot=True)
+
+
+class EventLoopMonitor:
+    """Measures event loop lag (how late a sleep of `interval` seconds wakes up)
+    and samples the process' resident set size, while running."""
+
+    def __init__(self, interval: float = 0.01) -> None:
+        self.interval = interval
+        self.lags: list[float] = []
+        self.peak_rss = 0
+        self._task: asyncio.Task | None = None
+
+    def __enter__(self) -> EventLoopMonitor:
+        self._task = asyncio.create_task(self._run())
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._task.cancel()
+
+    async def _run(self) -> None:
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.lags.append(max(time.perf_counter() - start - self.interval, 0.0))
+            self.peak_rss = max(self.peak_rss, current_rss())
+
+
+def current_rss() -> int:
+    """Resident set size in bytes (falls back to the peak so far where /proc isn't available)."""
+    try:
+        with open("/proc/self/statm", "r") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        scale = 1 if sys.platform == "darwin" else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+class LoadTest:
+    def __init__(self, bot: typing.Any, args: argparse.Namespace) -> None:
+        self.bot = bot
+        self.args = args
+        self.rng = random.Random(args.seed)
+
+        self.users = []
+        for guild_index in range(args.guilds):
+            guild = FakeGuild(next(_ids))
+            channel = FakeChannel(guild, args.discord_latency)
+            for user_index in range(args.users):
+                self.users.append((channel, FakeUser(next(_ids), f"user-{guild_index}-{user_index}")))
+
+        # The bot's latest reply to each user, which later messages from them may reply to.
+        self.last_reply: dict[int, FakeMessage] = {}
+
+    def build_message(self, route: str | None) -> FakeMessage:
+        channel, user = self.rng.choice(self.users)
+        questions = [question for question in QUESTIONS if route is None or question.route == route]
+        question = self.rng.choice(questions)
+
+        previous = self.last_reply.get(user.id)
+        if previous is not None and self.rng.random() < self.args.reply_ratio:
+            return channel.add(FakeMessage(question.text, user, channel, FakeReference(previous)))
+
+        greeting = self.rng.choice(["hey", "hi", "yo", "hello"])
+        return channel.add(FakeMessage(f"{greeting} speeb {question.text}", user, channel))
+
+    async def send(self, message: FakeMessage, results: list[tuple[str, float]]) -> None:
+        start = time.perf_counter()
+        try:
+            await self.bot.on_message(message)
+        except Exception as e:
+            results.append((f"error ({type(e).__name__})", time.perf_counter() - start))
+            return
+
+        latency = time.perf_counter() - start
+        replies = [reply for reply in message.replies if not reply.deleted]
+
+        if not replies:
+            outcome = "ignored"
+        elif replies[-1].content == self.bot.SHED_RESPONSE:
+            outcome = "shed"
+        elif replies[-1].content.startswith("> Response removed"):
+            outcome = "removed"
+        else:
+            outcome = "ok"
+            self.last_reply[message.author.id] = replies[-1]
+
+        results.append((outcome, latency))
+
+    async def phase(self, name: str, route: str | None) -> dict[str, typing.Any]:
+        results: list[tuple[str, float]] = []
+        tasks = []
+
+        with EventLoopMonitor() as monitor:
+            start = time.perf_counter()
+            for _ in range(self.args.messages):
+                tasks.append(asyncio.create_task(self.send(self.build_message(route), results)))
+                await asyncio.sleep(self.rng.expovariate(self.args.rate))
+
+            await asyncio.gather(*tasks)
+            elapsed = time.perf_counter() - start
+
+        latencies = [latency for outcome, latency in results if outcome == "ok"]
+        outcomes = {}
+        for outcome, _ in results:
+            outcomes[outcome] = outcomes.get(outcome, 0) + 1
+
+        return {
+            "phase": name,
+            "ok": len(latencies),
+            "outcomes": outcomes,
+            "p50": percentile(latencies, 0.5),
+            "p95": percentile(latencies, 0.95),
+            "p99": percentile(latencies, 0.99),
+            "throughput": len(latencies) / elapsed if elapsed else 0.0,
+            "lag_p99": percentile(monitor.lags, 0.99),
+            "lag_max": max(monitor.lags, default=0.0),
+            "peak_rss": monitor.peak_rss,
+        }
+
+
+def configure_environment(urls: dict[str, str], cold_caches: bool) -> None:
+    # Must run before main (and with it, the gateways) is imported.
+    os.environ.update({
+        "OPENAI_API_KEY": "stand-in", "OPENAI_BASE_URL": f"{urls['openai']}/v1",
+        "GEMINI_API_KEY": "stand-in", "GEMINI_BASE_URL": f"{urls['gemini']}/",
+        "BRAVE_SEARCH_API_KEY": "stand-in", "BRAVE_BASE_URL": urls["brave"],
+        "WEATHER_API_KEY": "stand-in", "WEATHER_BASE_URL": urls["weather"],
+        "GENIUS_API_KEY": "stand-in", "GENIUS_BASE_URL": urls["genius"],
+    })
+    os.environ.pop("GENIUS_CACHE_PATH", None)
+    os.environ.pop("ROUTING_LOG_PATH", None)
+
+    if cold_caches:
+        for variable in ("BRAVE_CACHE_TTL", "WEATHER_CACHE_TTL", "GENIUS_CACHE_TTL"):
+            os.environ[variable] = "0"
+
+
+def print_report(reports: list[dict[str, typing.Any]], servers: list[StandInServer]) -> None:
+    print(f"{'phase':<10} {'ok':>5} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'msg/s':>7} "
+          f"{'lag p99':>8} {'lag max':>8} {'peak RSS':>9}  outcomes")
+
+    for report in reports:
+        print(f"{report['phase']:<10} {report['ok']:>5} {report['p50'] * 1000:>8.0f} {report['p95'] * 1000:>8.0f} "
+              f"{report['p99'] * 1000:>8.0f} {report['throughput']:>7.1f} {report['lag_p99'] * 1000:>7.1f}ms "
+              f"{report['lag_max'] * 1000:>6.1f}ms {report['peak_rss'] / 2 ** 20:>7.0f}MB  {report['outcomes']}")
+
+    print()
+    for server in servers:
+        print(f"{server.name:<8} {server.stats()}")
+
+
+async def run(args: argparse.Namespace) -> None:
+    profiles = dict(DEFAULT_PROFILES)
+    for spec in args.profile:
+        upstream, _, profile = spec.partition("=")
+        profiles[upstream] = LatencyProfile.parse(profile)
+
+    if args.error_rate is not None:
+        for profile in profiles.values():
+            profile.error_rate = args.error_rate
+
+    servers = [StandInServer(name, handler, profiles[name], args.seed) for name, handler in HANDLERS.items()]
+    urls = {server.name: await server.start() for server in servers}
+
+    configure_environment(urls, args.cold_caches)
+
+    import main as bot
+    # The bot is never logged in, so its user is faked too.
+    bot.client._connection.user = BOT_USER
+
+    load_test = LoadTest(bot, args)
+    reports = []
+
+    try:
+        for route in args.routes:
+            reports.append(await load_test.phase(f"--{route}", f"--{route}"))
+
+        if not args.skip_mixed:
+            reports.append(await load_test.phase("mixed", None))
+
+    finally:
+        for gateway in (bot.brave_search_gateway, bot.weather_gateway, bot.genius_gateway):
+            await gateway.client.aclose()
+        await bot.openai_gateway.client.close()
+        await bot.google_gateway.client.aio.aclose()
+
+        for server in servers:
+            await server.close()
+
+    print_report(reports, servers)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Replay a synthetic message trace against local stand-in APIs.")
+    parser.add_argument("--messages", type=int, default=200, help="messages per phase")
+    parser.add_argument("--rate", type=float, default=20.0, help="mean arrival rate, in messages per second")
+    # Given without the leading dashes, which argparse would take for options.
+    parser.add_argument("--routes", nargs="+", default=[route.lstrip("-") for route in ROUTES],
+                        choices=[route.lstrip("-") for route in ROUTES])
+    parser.add_argument("--skip-mixed", action="store_true", help="don't run the phase with every route mixed")
+    parser.add_argument("--guilds", type=int, default=5)
+    parser.add_argument("--users", type=int, default=10, help="users per guild")
+    parser.add_argument("--reply-ratio", type=float, default=0.3)
+    parser.add_argument("--discord-latency", type=float, default=0.05, help="latency of each Discord REST call")
+    parser.add_argument("--profile", action="append", default=[],
+                        help="upstream=latency[:jitter[:error_rate[:chunk_interval]]], may be repeated")
+    parser.add_argument("--error-rate", type=float, default=None, help="error rate for every upstream")
+    parser.add_argument("--cold-caches", action="store_true", help="disable the gateways' response caches")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
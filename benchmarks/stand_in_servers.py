@@ -0,0 +1,413 @@
+"""
+Local stand-ins for the bot's upstream APIs (OpenAI, Gemini, Brave Search, Genius
+and OpenWeatherMap), used by the load test so it doesn't need network access or
+API keys.
+
+Each upstream gets its own StandInServer, a minimal keep-alive HTTP/1.1 server
+on 127.0.0.1 that answers with canned responses in the shape the gateways (and
+the OpenAI and Gemini SDKs) expect, after a configurable latency and jitter.
+A configurable fraction of requests fail with a 503.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import random
+import re
+import time
+import typing
+from dataclasses import dataclass
+from http import HTTPStatus
+from urllib.parse import parse_qs
+from urllib.parse import unquote
+from urllib.parse import urlsplit
+
+
+@dataclass
+class LatencyProfile:
+    """Response latency (seconds, before the first byte), +/- uniform jitter, and the fraction of
+    requests answered with a 503. For streamed responses, `chunk_interval` is the delay between chunks."""
+    latency: float = 0.05
+    jitter: float = 0.0
+    error_rate: float = 0.0
+    chunk_interval: float = 0.0
+
+    @classmethod
+    def parse(cls, spec: str) -> LatencyProfile:
+        """Parses "latency[:jitter[:error_rate[:chunk_interval]]]", e.g. "0.3:0.1:0.01"."""
+        return cls(*(float(value) for value in spec.split(":")))
+
+    def sample(self, rng: random.Random) -> float:
+        return max(self.latency + rng.uniform(-self.jitter, self.jitter), 0.0)
+
+
+@dataclass
+class Response:
+    status: int = 200
+    body: bytes | dict | None = None
+    content_type: str = "application/json"
+
+    # If set, the body is sent with chunked encoding, one chunk per item.
+    chunks: list[bytes] | None = None
+
+
+@dataclass
+class Request:
+    method: str
+    path: str
+    query: dict[str, str]
+    body: bytes
+
+    def json(self) -> typing.Any:
+        return json.loads(self.body) if self.body else None
+
+
+Handler = typing.Callable[[Request], Response]
+
+
+class StandInServer:
+    """Serves `handler` over HTTP/1.1, with keep-alive, on an ephemeral port."""
+
+    def __init__(self, name: str, handler: Handler, profile: LatencyProfile | None = None,
+                 seed: int | None = None) -> None:
+        self.name = name
+        self.handler = handler
+        self.profile = profile if profile is not None else LatencyProfile()
+
+        self._rng = random.Random(seed)
+        self._server: asyncio.Server | None = None
+        self._connections: dict[asyncio.StreamWriter, asyncio.Task] = {}
+
+        self.requests = 0
+        self.errors = 0
+        self.connections = 0
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.sockets[0].getsockname()[:2]
+        return f"http://{host}:{port}"
+
+    async def start(self) -> str:
+        self._server = await asyncio.start_server(self._serve, "127.0.0.1", 0)
+        return self.base_url
+
+    async def close(self) -> None:
+        if self._server is None:
+            return
+
+        self._server.close()
+
+        # Closing the connections ends their handlers, which are waited for so none are left pending.
+        for writer in list(self._connections):
+            writer.close()
+        await asyncio.gather(*self._connections.values(), return_exceptions=True)
+        await self._server.wait_closed()
+
+    def stats(self) -> dict[str, int]:
+        return {"requests": self.requests, "errors": self.errors, "connections": self.connections}
+
+    # helper functions
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.connections += 1
+        self._connections[writer] = asyncio.current_task()
+
+        try:
+            while True:
+                request = await self._read_request(reader)
+                if request is None:
+                    break
+
+                await self._respond(request, writer)
+
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+
+        finally:
+            self._connections.pop(writer, None)
+            writer.close()
+
+    @staticmethod
+    async def _read_request(reader: asyncio.StreamReader) -> Request | None:
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+
+        method, target, _ = request_line.decode("latin-1").split(" ", 2)
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            body = b""
+            while True:
+                size = int((await reader.readline()).split(b";")[0], 16)
+                chunk = await reader.readexactly(size + 2)
+                if size == 0:
+                    break
+                body += chunk[:-2]
+        else:
+            body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+        url = urlsplit(target)
+        query = {key: values[0] for key, values in parse_qs(url.query, keep_blank_values=True).items()}
+
+        return Request(method, unquote(url.path), query, body)
+
+    async def _respond(self, request: Request, writer: asyncio.StreamWriter) -> None:
+        self.requests += 1
+        await asyncio.sleep(self.profile.sample(self._rng))
+
+        if self._rng.random() < self.profile.error_rate:
+            self.errors += 1
+            response = Response(503, {"error": {"message": f"{self.name} stand-in: injected error"}})
+        else:
+            try:
+                response = self.handler(request)
+            except Exception as e:
+                self.errors += 1
+                response = Response(500, {"error": {"message": f"{self.name} stand-in: {e!r}"}})
+
+        head = (f"HTTP/1.1 {response.status} {HTTPStatus(response.status).phrase}\r\n"
+                f"Content-Type: {response.content_type}\r\n")
+
+        if response.chunks is None:
+            body = response.body
+            if isinstance(body, dict):
+                body = json.dumps(body).encode()
+            elif body is None:
+                body = b""
+
+            writer.write(f"{head}Content-Length: {len(body)}\r\n\r\n".encode() + body)
+            await writer.drain()
+            return
+
+        writer.write(f"{head}Transfer-Encoding: chunked\r\n\r\n".encode())
+        for chunk in response.chunks:
+            writer.write(f"{len(chunk):x}\r\n".encode() + chunk + b"\r\n")
+            await writer.drain()
+            if self.profile.chunk_interval > 0:
+                await asyncio.sleep(self.profile.chunk_interval)
+
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+
+# Canned upstream responses.
+# Each route in the trace has a few questions, along with the arguments Gemini would extract for them.
+
+@dataclass(frozen=True)
+class TraceQuestion:
+    route: str
+    text: str
+    arguments: dict[str, typing.Any]
+
+
+QUESTIONS: list[TraceQuestion] = [
+    TraceQuestion("--web", "who won the super bowl this year?", {"search_term": "super bowl 2026"}),
+    TraceQuestion("--web", "who is the current prime minister of canada?", {"search_term": "prime minister of canada"}),
+    TraceQuestion("--web", "who's the star player of the toronto blue jays?", {"search_term": "blue jays star player"}),
+    TraceQuestion("--weather", "what's the weather like in toronto right now?",
+                  {"locations": [{"city": "Toronto", "country": "CA"}]}),
+    TraceQuestion("--weather", "is it raining in london?", {"locations": [{"city": "London", "country": "GB"}]}),
+    TraceQuestion("--weather", "is it warmer in toronto or vancouver?",
+                  {"locations": [{"city": "Toronto", "country": "CA"}, {"city": "Vancouver", "country": "CA"}]}),
+    TraceQuestion("--song", "what song am i listening to right now?",
+                  {"song_name": "Never Gonna Give You Up", "song_artists": ["Rick Astley"]}),
+    TraceQuestion("--song", "tell me about bohemian rhapsody by queen",
+                  {"song_name": "Bohemian Rhapsody", "song_artists": ["Queen"]}),
+    TraceQuestion("--artist", "who sang this song?", {"artist": "Rick Astley"}),
+    TraceQuestion("--artist", "can you tell me about taylor swift?", {"artist": "Taylor Swift"}),
+    TraceQuestion("--logic", "can you solve the equation 3x + 7 = 22?", {}),
+    TraceQuestion("--logic", "can you help me debug this python function?", {}),
+    TraceQuestion("--none", "how's your day going?", {}),
+    TraceQuestion("--none", "do you like never gonna give you up?", {}),
+]
+
+ROUTES = ["--web", "--weather", "--song", "--artist", "--logic", "--none"]
+
+_REPLY = ("Oh, you want an answer? Fine. Here's the short version, since I know you won't read the long one: "
+          "it depends, but mostly yes. You're welcome, and try to keep up next time.")
+
+
+def _find_question(text: str) -> TraceQuestion | None:
+    text = text.lower()
+    for question in QUESTIONS:
+        if question.text in text:
+            return question
+
+    return None
+
+
+def _texts(value: typing.Any) -> list[str]:
+    # Collects every "text" field of a (nested) request payload.
+    if isinstance(value, dict):
+        return [text for key, item in value.items()
+                for text in ([item] if key == "text" and isinstance(item, str) else _texts(item))]
+
+    if isinstance(value, list):
+        return [text for item in value for text in _texts(item)]
+
+    return []
+
+
+def openai_handler(request: Request) -> Response:
+    payload = request.json()
+
+    if request.path.endswith("/moderations"):
+        inputs = payload["input"] if isinstance(payload["input"], list) else [payload["input"]]
+        return Response(body={
+            "id": "modr-stand-in",
+            "model": payload.get("model", "omni-moderation-latest"),
+            "results": [{"flagged": False, "categories": {"harassment": False, "violence": False},
+                         "category_scores": {"harassment": 0.0001, "violence": 0.0001}} for _ in inputs],
+        })
+
+    if not request.path.endswith("/chat/completions"):
+        return Response(404, {"error": {"message": f"Unknown path {request.path}"}})
+
+    model = payload.get("model", "gpt-5-nano")
+    words = _REPLY.split(" ")
+    usage = {"prompt_tokens": sum(len(text) for text in _texts(payload["messages"])) // 4,
+             "completion_tokens": len(words), "total_tokens": 0}
+
+    if not payload.get("stream"):
+        return Response(body={
+            "id": "chatcmpl-stand-in", "object": "chat.completion", "created": int(time.time()), "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": _REPLY}, "finish_reason": "stop"}],
+            "usage": usage,
+        })
+
+    def event(delta: dict, finish_reason: str | None = None) -> bytes:
+        chunk = {"id": "chatcmpl-stand-in", "object": "chat.completion.chunk", "created": int(time.time()),
+                 "model": model, "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+        return f"data: {json.dumps(chunk)}\n\n".encode()
+
+    chunks = [event({"role": "assistant", "content": ""})]
+    chunks.extend(event({"content": word if index == 0 else f" {word}"}) for index, word in enumerate(words))
+    chunks.append(event({}, "stop"))
+    chunks.append(b"data: [DONE]\n\n")
+
+    return Response(content_type="text/event-stream", chunks=chunks)
+
+
+def gemini_handler(request: Request) -> Response:
+    payload = request.json()
+    instructions = " ".join(_texts(payload.get("systemInstruction", payload.get("system_instruction"))))
+    content = " ".join(_texts(payload["contents"]))
+
+    question = _find_question(content)
+    route = question.route if question is not None else "--none"
+    arguments = question.arguments if question is not None else {}
+
+    config = payload.get("generationConfig", payload.get("generation_config")) or {}
+
+    if config.get("responseMimeType", config.get("response_mime_type")) == "application/json":
+        text = json.dumps({"flag": route, **arguments})
+
+    elif "SEO term" in instructions:
+        text = arguments.get("search_term", content[:40])
+
+    elif "song's name and artist" in instructions:
+        text = (f"{arguments['song_name']}\n" + ",".join(f'"{artist}"' for artist in arguments["song_artists"])
+                if "song_name" in arguments else "none")
+
+    elif "main artist mentioned" in instructions:
+        text = arguments.get("artist", "none")
+
+    elif "locations they want access to" in instructions:
+        text = ("\n".join(f"{location['city']}, {location['country']}" for location in arguments["locations"])
+                if "locations" in arguments else "none")
+
+    else:
+        text = route
+
+    return Response(body={
+        "candidates": [{"content": {"role": "model", "parts": [{"text": text}]}, "finishReason": "STOP", "index": 0}],
+        "usageMetadata": {"promptTokenCount": len(content) // 4, "candidatesTokenCount": len(text) // 4},
+        "modelVersion": "stand-in",
+    })
+
+
+def brave_handler(request: Request) -> Response:
+    query = request.query.get("q", "")
+    return Response(body={"web": {"results": [
+        {"title": f"{query.title()} - result {index}", "url": f"https://example.com/{index}",
+         "description": f"Everything you need to know about {query}, in result number {index}.",
+         "meta_url": {"netloc": "example.com"}}
+        for index in range(3)
+    ]}})
+
+
+def weather_handler(request: Request) -> Response:
+    city, _, country = request.query.get("q", "Toronto,CA").partition(",")
+    now = int(time.time())
+
+    return Response(body={
+        "name": city.strip().title(),
+        "sys": {"country": country.strip().upper() or "CA", "sunrise": now - 6 * 3600, "sunset": now + 6 * 3600},
+        "weather": [{"description": "scattered clouds", "icon": "03d"}],
+        "main": {"temp": 12.3, "temp_max": 15.1, "temp_min": 9.8, "feels_like": 10.9},
+        "visibility": 10000,
+        "wind": {"deg": 220, "speed": 4.1},
+        "timezone": 0,
+    })
+
+
+_GENIUS_PATH = re.compile(r"/(songs|artists)/(\d+)$")
+
+
+def genius_handler(request: Request) -> Response:
+    if request.path.endswith("/search"):
+        # Ids are derived from the query, so that repeated searches resolve to the same song.
+        song_id = sum(request.query.get("q", "").lower().encode()) % 100000
+        return Response(body={"response": {"hits": [
+            {"result": {"id": song_id, "primary_artist": {"id": song_id + 1}}}
+        ]}})
+
+    match = _GENIUS_PATH.search(request.path)
+    if match is None:
+        return Response(404, {"meta": {"status": 404}})
+
+    kind, item_id = match.groups()
+    if kind == "songs":
+        return Response(body={"response": {"song": {
+            "full_title": f"Song {item_id} by Some Artist",
+            "description": {"plain": f"Song {item_id} is a song.\nIt was released at some point."},
+            "artist_names": "Some Artist",
+            "album": {"name": f"Album {item_id}", "cover_art_url": "https://example.com/cover.png"},
+            "release_date_for_display": "July 27, 1987",
+            "url": f"https://genius.com/songs/{item_id}",
+        }}})
+
+    return Response(body={"response": {"artist": {
+        "name": f"Artist {item_id}",
+        "description": {"plain": f"Artist {item_id} makes music.\nSome of it is good."},
+        "alternate_names": [],
+        "image_url": "https://example.com/artist.png",
+        "url": f"https://genius.com/artists/{item_id}",
+        "instagram_name": "artist",
+        "twitter_name": "artist",
+    }}})
+
+
+HANDLERS: dict[str, Handler] = {
+    "openai": openai_handler,
+    "gemini": gemini_handler,
+    "brave": brave_handler,
+    "weather": weather_handler,
+    "genius": genius_handler,
+}
+
+DEFAULT_PROFILES: dict[str, LatencyProfile] = {
+    "openai": LatencyProfile(latency=0.4, jitter=0.15, chunk_interval=0.01),
+    "gemini": LatencyProfile(latency=0.25, jitter=0.1),
+    "brave": LatencyProfile(latency=0.3, jitter=0.1),
+    "weather": LatencyProfile(latency=0.15, jitter=0.05),
+    "genius": LatencyProfile(latency=0.2, jitter=0.08),
+}
@@ -0,0 +1,104 @@
+"""
+Measures how many messages per second the wake word check handles, on synthetic
+chat traffic where only a small fraction of messages wake the bot up. Compares
+WakeWordMatcher with the check it replaced (which normalized and split every
+message), and checks that both agree on every message.
+
+Usage:
+    python -m benchmarks.wake_words [--messages 200000] [--wake-ratio 0.01] [--repeat 5]
+"""
+from __future__ import annotations
+
+import argparse
+import random
+import time
+import typing
+
+from routing.wake_words import WakeWordMatcher
+
+ALIASES = ["speeb", "speebot", "speebgpt"]
+WAKE_UP = ["hi", "hey", "heya", "good *", "whats up", "yo", "hello", "happy *"]
+
+_CHATTER = [
+    "lmao", "no way", "did anyone see the game last night?", "brb getting food", "that's actually so true",
+    "who's on tonight", "gg", "ok but hear me out", "https://youtu.be/dQw4w9WgXcQ", "<:pepe_laugh:123456789>",
+    "can someone send the notes from today's lecture", "I'm so tired 😭", "yo what's up everyone",
+    "hey guys", "good morning!!", "happy birthday @Jake 🎉", "hello?", "ping me when you're on",
+    "the speedrun was insane", "honestly the speaker was boring", "i think speeb is down again lol",
+    "```py\nprint('hello world')\n```", "WHAT", "agreed", "this channel is dead", "hi",
+]
+
+_WAKE_UPS = [
+    "hey speeb what's the weather in toronto?", "hi speebot", "Yo Speeb, who won the game last night?",
+    "good morning speeb!", "happy friday speebgpt, any plans?", "whats up speeb", "hello SpeebGPT can you help me",
+    "heya speeb :)", "good evening, speebot. what song is this?",
+]
+
+
+def legacy_check(content: str) -> bool:
+    # The wake word check as it was before WakeWordMatcher, except that it used to raise
+    # IndexError for messages whose words were separated by line breaks (e.g. code blocks).
+    try:
+        return _legacy_check(content)
+    except IndexError:
+        return False
+
+
+def _legacy_check(content: str) -> bool:
+    if len(content.split()) > 1:
+        check_string = ''.join(char.lower() if char.isalnum() or char == ' ' else '' for char in list(content))
+        check_list = check_string.split(' ')
+
+        for alias in ALIASES:
+            if alias in check_list[1] and check_list[0] in WAKE_UP:
+                return True
+
+        if len(content.split()) > 2:
+            for alias in ALIASES:
+                if alias in check_list[2] and (' '.join((check_list[0], check_list[1])) in WAKE_UP or
+                                               check_list[0] == "good" or check_list[0] == "happy"):
+                    return True
+
+    return False
+
+
+def build_traffic(count: int, wake_ratio: float, seed: int) -> list[str]:
+    rng = random.Random(seed)
+    return [rng.choice(_WAKE_UPS) if rng.random() < wake_ratio else rng.choice(_CHATTER) for _ in range(count)]
+
+
+def messages_per_second(check: typing.Callable[[str], bool], traffic: list[str], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for content in traffic:
+            check(content)
+        best = min(best, time.perf_counter() - start)
+
+    return len(traffic) / best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the wake word check.")
+    parser.add_argument("--messages", type=int, default=200000)
+    parser.add_argument("--wake-ratio", type=float, default=0.01, help="fraction of messages that wake the bot up")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    traffic = build_traffic(args.messages, args.wake_ratio, args.seed)
+    matcher = WakeWordMatcher(ALIASES, WAKE_UP)
+
+    disagreements = [content for content in set(traffic) if matcher.matches(content) != legacy_check(content)]
+    if disagreements:
+        print(f"The matchers disagree on: {disagreements}")
+
+    legacy = messages_per_second(legacy_check, traffic, args.repeat)
+    compiled = messages_per_second(matcher.matches, traffic, args.repeat)
+
+    print(f"legacy check:     {legacy:>12,.0f} messages/s")
+    print(f"WakeWordMatcher:  {compiled:>12,.0f} messages/s ({compiled / legacy:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
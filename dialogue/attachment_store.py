@@ -0,0 +1,232 @@
+from __future__ import annotations
+
+import asyncio
+import base64
+import contextlib
+import hashlib
+import mmap
+import re
+import tempfile
+import threading
+import typing
+from collections import OrderedDict
+
+
+class _Blob:
+    """A single stored attachment."""
+
+    __slots__ = ("size", "pages", "data", "spill_file", "refcount", "data_url", "pins")
+
+    # Page objects of a PDF ("/Type /Page", but not "/Type /Pages")
+    _PAGE_PATTERN = re.compile(rb"/Type\s*/Page(?![a-zA-Z])")
+
+    def __init__(self, data: bytes) -> None:
+        self.size = len(data)
+        # Pages inside compressed object streams can't be counted, so every PDF has at least one.
+        self.pages = max(len(_Blob._PAGE_PATTERN.findall(data)), 1)
+        self.data: bytes | mmap.mmap = data
+        self.spill_file = None
+        self.refcount = 1
+        self.data_url: str | None = None
+        # Number of payloads being built with the blob's data URL (see AttachmentStore.pinned)
+        self.pins = 0
+
+
+class AttachmentStore:
+    """
+    Content-addressed store for attachment bytes, keyed by SHA-256.
+
+    The same attachment posted in several messages (or conversations) is only
+    stored once, and is removed when the last File referencing it is garbage
+    collected. Base64 data URLs are only built when a request payload needs them
+    (see encode), and are shared by every message with that attachment.
+
+    Once the bytes held in memory exceed `max_memory_bytes`, the least recently
+    used data URLs are dropped (to be encoded again when a payload next needs
+    them), then raw bytes are moved to a temporary file and read back through
+    mmap. Raw bytes of blobs larger than `spill_threshold` are always spilled.
+    Data URLs of pinned blobs (whose payloads are being built) are never dropped.
+    """
+
+    _MAX_MEMORY_BYTES: int
+    _SPILL_THRESHOLD: int
+
+    def __init__(self, max_memory_bytes: int = 256 * 1024 * 1024, spill_threshold: int = 16 * 1024 * 1024,
+                 spill_dir: str | None = None) -> None:
+        self._MAX_MEMORY_BYTES = max_memory_bytes
+        self._SPILL_THRESHOLD = spill_threshold
+        self._spill_dir = spill_dir
+
+        # Blobs are released from finalizers, which may run on any thread.
+        self._lock = threading.RLock()
+        self._blobs: dict[str, _Blob] = {}
+        # Blobs with a data URL, from least to most recently used.
+        self._encoded: OrderedDict[str, _Blob] = OrderedDict()
+
+        self._memory_bytes = 0
+        self._spilled_bytes = 0
+        self._deduplicated = 0
+        self._dropped_data_urls = 0
+
+    def __contains__(self, digest: str) -> bool:
+        return digest in self._blobs
+
+    def put(self, data: bytes) -> str:
+        """Stores data (if not already stored), takes a reference to it and returns its digest."""
+        digest = hashlib.sha256(data).hexdigest()
+
+        with self._lock:
+            blob = self._blobs.get(digest)
+            if blob is not None:
+                blob.refcount += 1
+                self._deduplicated += 1
+                return digest
+
+            blob = _Blob(data)
+            self._blobs[digest] = blob
+            self._memory_bytes += blob.size
+
+            if blob.size >= self._SPILL_THRESHOLD:
+                self._spill(blob)
+
+            self._enforce_memory_limit()
+
+        return digest
+
+    def release(self, digest: str) -> None:
+        """Drops a reference taken by put, removing the blob once nothing references it."""
+        with self._lock:
+            blob = self._blobs.get(digest)
+            if blob is None:
+                return
+
+            blob.refcount -= 1
+            if blob.refcount > 0:
+                return
+
+            del self._blobs[digest]
+            self._encoded.pop(digest, None)
+            self._memory_bytes -= self._resident_size(blob)
+
+            if blob.spill_file is not None:
+                self._spilled_bytes -= blob.size
+                blob.data.close()
+                blob.spill_file.close()
+
+    def size(self, digest: str) -> int:
+        return self._blobs[digest].size
+
+    def pages(self, digest: str) -> int:
+        """Number of pages of a stored PDF (counted when it was stored)."""
+        return self._blobs[digest].pages
+
+    def is_encoded(self, digest: str) -> bool:
+        return self._blobs[digest].data_url is not None
+
+    def data_url(self, digest: str, mime_type: str = "application/pdf") -> str:
+        """Returns the base64 data URL for a blob, encoding it if that hasn't happened yet.
+        Prefer awaiting encode beforehand, so that the encoding happens off the event loop."""
+        with self._lock:
+            blob = self._blobs[digest]
+            data_url = blob.data_url
+            if data_url is not None:
+                self._encoded.move_to_end(digest)
+                return data_url
+
+        return self._encode(digest, mime_type)
+
+    @contextlib.contextmanager
+    def pinned(self, digests: typing.Iterable[str]) -> typing.Iterator[None]:
+        """Keeps the data URLs of the given blobs from being dropped inside the block, so that
+        a payload can be encoded (with encode) and then built without encoding on the event loop."""
+        with self._lock:
+            blobs = [self._blobs[digest] for digest in set(digests) if digest in self._blobs]
+            for blob in blobs:
+                blob.pins += 1
+
+        try:
+            yield
+
+        finally:
+            with self._lock:
+                for blob in blobs:
+                    blob.pins -= 1
+                self._enforce_memory_limit()
+
+    async def encode(self, digest: str, mime_type: str = "application/pdf") -> None:
+        """Builds the data URL for a blob in a worker thread (if it hasn't been built yet)."""
+        if not self.is_encoded(digest):
+            await asyncio.to_thread(self._encode, digest, mime_type)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "blobs": len(self._blobs),
+            "memory_bytes": self._memory_bytes,
+            "spilled_bytes": self._spilled_bytes,
+            "max_memory_bytes": self._MAX_MEMORY_BYTES,
+            "deduplicated": self._deduplicated,
+            "dropped_data_urls": self._dropped_data_urls,
+        }
+
+    # helper functions
+
+    def _encode(self, digest: str, mime_type: str) -> str:
+        with self._lock:
+            blob = self._blobs[digest]
+            data = blob.data
+
+        data_url = f"data:{mime_type};base64,{base64.b64encode(data).decode('utf-8')}"
+
+        with self._lock:
+            if blob.data_url is None and digest in self._blobs:
+                blob.data_url = data_url
+                self._encoded[digest] = blob
+                self._memory_bytes += len(data_url)
+                # The new data URL is about to be used, so it's dropped last.
+                self._enforce_memory_limit(keep=blob)
+
+        return data_url
+
+    @staticmethod
+    def _resident_size(blob: _Blob) -> int:
+        size = len(blob.data_url) if blob.data_url is not None else 0
+        if blob.spill_file is None:
+            size += blob.size
+
+        return size
+
+    def _spill(self, blob: _Blob) -> None:
+        spill_file = tempfile.TemporaryFile(dir=self._spill_dir)
+        spill_file.write(blob.data)
+        spill_file.flush()
+
+        blob.data = mmap.mmap(spill_file.fileno(), 0, access=mmap.ACCESS_READ)
+        blob.spill_file = spill_file
+
+        self._memory_bytes -= blob.size
+        self._spilled_bytes += blob.size
+
+    def _enforce_memory_limit(self, keep: _Blob | None = None) -> None:
+        if self._memory_bytes <= self._MAX_MEMORY_BYTES:
+            return
+
+        # Drop the least recently used data URLs first, since they can be rebuilt from the raw bytes.
+        for digest, blob in list(self._encoded.items()):
+            if self._memory_bytes <= self._MAX_MEMORY_BYTES:
+                return
+            if blob is keep or blob.pins > 0:
+                continue
+
+            del self._encoded[digest]
+            self._memory_bytes -= len(blob.data_url)
+            blob.data_url = None
+            self._dropped_data_urls += 1
+
+        # Then spill the largest in-memory blobs.
+        in_memory = sorted((blob for blob in self._blobs.values() if blob.spill_file is None and blob.size > 0),
+                           key=lambda blob: blob.size, reverse=True)
+
+        for blob in in_memory:
+            if self._memory_bytes <= self._MAX_MEMORY_BYTES:
+                break
+            self._spill(blob)
@@ -1,48 +1,135 @@
 from __future__ import annotations
+import functools
+from collections import deque
+from dialogue.message import File
 from dialogue.message import Message
+from dialogue.message import Role
 
 class Conversation:
     """
     Conversation class to represent a list of messages.
+
+    The system message (instructions) is always kept, as is the current turn (see
+    ensure_length). The oldest other messages are evicted once the conversation
+    exceeds either _MAX_CONVERSATION_LENGTH messages or its token budget (estimated
+    locally, see Message.token_count).
     """
 
+    __slots__ = ("_INSTRUCTIONS", "_SYSTEM_MESSAGE", "_MESSAGES", "_SERIALIZED", "_TOKEN_COUNT", "_MAX_TOKENS")
+
     _INSTRUCTIONS: str
-    _MESSAGES: list[Message]
+    _SYSTEM_MESSAGE: Message
+    _MESSAGES: deque[Message]
+    _SERIALIZED: deque[dict]
+    _TOKEN_COUNT: int
+    _MAX_TOKENS: int
     _MAX_CONVERSATION_LENGTH = 15
+    _DEFAULT_MAX_TOKENS = 8000
 
-    def __init__(self, instructions: str | None = None):
-        if instructions is None:
-            self._INSTRUCTIONS = """
+    _DEFAULT_INSTRUCTIONS = """
             You are a helpful assistant named Speebot. 
             Give sassy and concise, but helpful responses. (Try and limit yourself to one or two sentences)
             Use the instructions given by the system to help form responses.
             """
 
+    def __init__(self, instructions: str | None = None, max_tokens: int | None = None):
+        if instructions is None:
+            self._INSTRUCTIONS = Conversation._DEFAULT_INSTRUCTIONS
+
         else:
             self._INSTRUCTIONS = instructions
 
-        self._MESSAGES = [Message("system", self._INSTRUCTIONS)]
+        if max_tokens is None:
+            self._MAX_TOKENS = Conversation._DEFAULT_MAX_TOKENS
+        else:
+            self._MAX_TOKENS = max_tokens
+
+        self._SYSTEM_MESSAGE = Conversation._system_message(self._INSTRUCTIONS)
+        self._MESSAGES = deque()
+        # Serialized messages, kept in step with _MESSAGES. Messages are serialized the
+        # first time a payload is built after they're added, so newly added messages
+        # are always the ones at the end of _MESSAGES without a serialized entry.
+        # Messages with files have None entries, and are serialized for every payload
+        # (see Message.to_dict).
+        self._SERIALIZED = deque()
+        self._TOKEN_COUNT = self._SYSTEM_MESSAGE.token_count
+
+    def __len__(self) -> int:
+        return len(self._MESSAGES) + 1
 
     def instructions(self) -> str | None:
         return self._INSTRUCTIONS
 
+    def token_count(self) -> int:
+        return self._TOKEN_COUNT
+
+    @staticmethod
+    @functools.lru_cache(maxsize=32)
+    def _system_message(instructions: str) -> Message:
+        # System messages are shared by every conversation with the same instructions,
+        # so they must never be modified in place.
+        return Message("system", instructions)
+
     def change_instructions(self, new_instructions: str) -> str:
         # Changes instructions to new ones and returns the old instructions
+        old_instructions = self._INSTRUCTIONS
         self._INSTRUCTIONS = new_instructions
-        return self._MESSAGES[0].change_text_content(new_instructions)
+
+        self._TOKEN_COUNT -= self._SYSTEM_MESSAGE.token_count
+        self._SYSTEM_MESSAGE = Conversation._system_message(new_instructions)
+        self._TOKEN_COUNT += self._SYSTEM_MESSAGE.token_count
+
+        return old_instructions
 
     def add_message(self, message: Message) -> None:
         self._MESSAGES.append(message)
+        self._TOKEN_COUNT += message.token_count
         self.ensure_length()
 
     def to_list_dict(self) -> list[dict]:
+        # Messages are only serialized once, so this doesn't rebuild (potentially
+        # large) attachment payloads on every call.
+        for index in range(len(self._SERIALIZED), len(self._MESSAGES)):
+            message = self._MESSAGES[index]
+            self._SERIALIZED.append(None if message.has_files() else message.to_dict())
+
+        output = [self._SYSTEM_MESSAGE.to_dict()]
+        output.extend(serialized if serialized is not None else message.to_dict()
+                      for message, serialized in zip(self._MESSAGES, self._SERIALIZED))
+
+        return output
+
+    def files(self) -> list[File]:
+        """Files in the conversation's messages, i.e. the files whose data URLs
+        the next call to to_list_dict will need."""
         output = []
 
         for message in self._MESSAGES:
-            output.append(message.to_dict())
+            if message.has_files():
+                output.extend(message.files)
 
         return output
 
+    def size_bytes(self) -> int:
+        """Approximate number of bytes retained by the messages in this conversation."""
+        return self._SYSTEM_MESSAGE.size_bytes() + sum(message.size_bytes() for message in self._MESSAGES)
+
+    def _current_turn_length(self) -> int:
+        # Number of messages added since the last assistant response (not counting
+        # the newest message, which may be the response to them).
+        for index in range(len(self._MESSAGES) - 2, -1, -1):
+            if self._MESSAGES[index].role is Role.ASSISTANT:
+                return len(self._MESSAGES) - 1 - index
+
+        return len(self._MESSAGES)
+
     def ensure_length(self):
-        while len(self._MESSAGES) > self._MAX_CONVERSATION_LENGTH:
-            self._MESSAGES.pop(1)
+        # The current turn (e.g. the message being replied to, the message being answered,
+        # integration results and the response) is always kept, even if it's over the token
+        # budget on its own, so the message being answered is never evicted to make room.
+        kept = max(self._current_turn_length(), 1)
+        while len(self._MESSAGES) > kept and (len(self._MESSAGES) + 1 > self._MAX_CONVERSATION_LENGTH
+                                              or self._TOKEN_COUNT > self._MAX_TOKENS):
+            self._TOKEN_COUNT -= self._MESSAGES.popleft().token_count
+            if self._SERIALIZED:
+                self._SERIALIZED.popleft()
@@ -0,0 +1,147 @@
+from __future__ import annotations
+
+import time
+import typing
+from collections import OrderedDict
+
+from dialogue.conversation import Conversation
+
+
+class _RegistryEntry:
+    """Bookkeeping for a single conversation held by the registry."""
+
+    __slots__ = ("conversation", "message_history", "last_access", "size")
+
+    def __init__(self, conversation: Conversation, last_access: float) -> None:
+        self.conversation = conversation
+        self.message_history: list[int] = []
+        self.last_access = last_access
+        self.size = 0
+
+
+class ConversationRegistry:
+    """
+    Keeps track of live conversations, indexed by the ids of the Discord
+    messages that belong to them.
+
+    Lookups by message id are O(1). Conversations that have been idle for
+    longer than the TTL are evicted, and the least recently used conversations
+    are evicted whenever the total retained size (including base64 encoded
+    PDF payloads) exceeds the byte budget.
+    """
+
+    _TTL: float
+    _MAX_BYTES: int
+
+    def __init__(self, ttl: float = 3600, max_bytes: int = 64 * 1024 * 1024,
+                 clock: typing.Callable[[], float] = time.monotonic) -> None:
+        self._TTL = ttl
+        self._MAX_BYTES = max_bytes
+        self._clock = clock
+
+        # message id -> entry
+        self._index: dict[int, _RegistryEntry] = {}
+
+        # id(conversation) -> entry, ordered from least to most recently used
+        self._entries: OrderedDict[int, _RegistryEntry] = OrderedDict()
+
+        self._total_bytes = 0
+
+        self._hits = 0
+        self._misses = 0
+        self._idle_evictions = 0
+        self._budget_evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, message_id: int) -> Conversation:
+        """Returns the conversation containing the given message id.
+        Raises KeyError if no (live) conversation contains it."""
+        now = self._clock()
+        self._evict_idle(now)
+
+        entry = self._index.get(message_id)
+        if entry is None:
+            self._misses += 1
+            raise KeyError(message_id)
+
+        self._hits += 1
+        self._touch(entry, now)
+        return entry.conversation
+
+    def register(self, conversation: Conversation, message_id: int) -> None:
+        """Starts tracking a conversation, beginning with the given message id."""
+        now = self._clock()
+        entry = _RegistryEntry(conversation, now)
+        self._entries[id(conversation)] = entry
+        self._add_message_id(entry, message_id)
+        self._touch(entry, now)
+
+    def link(self, conversation: Conversation, message_id: int) -> None:
+        """Adds a message id to an existing conversation (e.g. the bot's reply).
+        If the conversation has already been evicted, it is registered again."""
+        entry = self._entries.get(id(conversation))
+        if entry is None or entry.conversation is not conversation:
+            self.register(conversation, message_id)
+            return
+
+        self._add_message_id(entry, message_id)
+        self._touch(entry, self._clock())
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "conversations": len(self._entries),
+            "indexed_messages": len(self._index),
+            "bytes": self._total_bytes,
+            "max_bytes": self._MAX_BYTES,
+            "hits": self._hits,
+            "misses": self._misses,
+            "idle_evictions": self._idle_evictions,
+            "budget_evictions": self._budget_evictions,
+            "evictions": self._idle_evictions + self._budget_evictions,
+        }
+
+    # helper functions
+
+    def _add_message_id(self, entry: _RegistryEntry, message_id: int) -> None:
+        entry.message_history.append(message_id)
+        self._index[message_id] = entry
+
+    def _touch(self, entry: _RegistryEntry, now: float) -> None:
+        # Conversations grow between accesses, so their size is re-measured here.
+        entry.last_access = now
+        self._entries.move_to_end(id(entry.conversation))
+
+        new_size = entry.conversation.size_bytes()
+        self._total_bytes += new_size - entry.size
+        entry.size = new_size
+
+        self._evict_idle(now)
+        self._evict_over_budget(entry)
+
+    def _evict_idle(self, now: float) -> None:
+        # Entries are in LRU order, so expired ones are always at the front.
+        while self._entries:
+            oldest = next(iter(self._entries.values()))
+            if now - oldest.last_access <= self._TTL:
+                break
+            self._evict(oldest)
+            self._idle_evictions += 1
+
+    def _evict_over_budget(self, keep: _RegistryEntry) -> None:
+        # The conversation currently being used is never evicted, even if it
+        # exceeds the budget on its own.
+        while self._total_bytes > self._MAX_BYTES and len(self._entries) > 1:
+            oldest = next(iter(self._entries.values()))
+            if oldest is keep:
+                break
+            self._evict(oldest)
+            self._budget_evictions += 1
+
+    def _evict(self, entry: _RegistryEntry) -> None:
+        del self._entries[id(entry.conversation)]
+        for message_id in entry.message_history:
+            if self._index.get(message_id) is entry:
+                del self._index[message_id]
+        self._total_bytes -= entry.size
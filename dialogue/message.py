@@ -1,6 +1,23 @@
 from __future__ import annotations
-import base64
+import weakref
+from enum import Enum
 from typing import final
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from dialogue.attachment_store import AttachmentStore
+
+
+@final
+class Role(str, Enum):
+    """
+    Roles a message can have. Members are singletons, so every message shares
+    the same role objects.
+    """
+
+    SYSTEM = "system"
+    USER = "user"
+    ASSISTANT = "assistant"
 
 
 @final
@@ -9,14 +26,30 @@ class Message:
     Message object for conversation, to use for OpenAI API integration.
     """
 
+    __slots__ = ("role", "text_content", "images", "files", "token_count", "_dict")
+
+    role: Role
+
     # Images and files attachments
     images: list[Image] | None
     files: list[File] | None
     text_content: str
 
-    def __init__(self, role: str, text_content: str,
+    # Locally estimated number of tokens taken up by the message. PDFs are costed by
+    # page count (rather than size), up to _MAX_FILE_TOKENS each, so that one PDF
+    # can't take up the whole token budget of a conversation.
+    token_count: int
+
+    # Rough constants for estimating token counts without a tokenizer
+    _CHARS_PER_TOKEN = 4
+    _MESSAGE_OVERHEAD_TOKENS = 4
+    _IMAGE_TOKENS = 765
+    _FILE_PAGE_TOKENS = 300
+    _MAX_FILE_TOKENS = 3000
+
+    def __init__(self, role: str | Role, text_content: str,
                  images: list[Image] = None, files: list[File] = None):
-        self.role = role
+        self.role = Role(role)
         self.text_content = text_content
 
         self.images = images
@@ -31,6 +64,11 @@ class Message:
             if len(files) == 0:
                 self.files = None
 
+        self.token_count = self._estimate_tokens()
+
+        # Serialized form of the message, built on first use by to_dict
+        self._dict = None
+
     def has_images(self):
         return self.images is not None
 
@@ -42,9 +80,40 @@ class Message:
         # returns the previous text content
         old_content = self.text_content
         self.text_content = new_content
+        self.token_count = self._estimate_tokens()
+        self._dict = None
 
         return old_content
 
+    def size_bytes(self) -> int:
+        """Approximate number of bytes retained by this message, including
+        base64 file payloads. Used for memory budgeting, so it favours speed
+        over precision (character counts rather than encoded lengths)."""
+        size = len(self.role) + len(self.text_content)
+
+        if self.has_images():
+            for image in self.images:
+                size += len(image.url)
+
+        if self.has_files():
+            for file in self.files:
+                # base64 encodes 3 bytes into 4 characters
+                size += len(file.filename) + file.size * 4 // 3
+
+        return size
+
+    def _estimate_tokens(self) -> int:
+        tokens = Message._MESSAGE_OVERHEAD_TOKENS + len(self.text_content) // Message._CHARS_PER_TOKEN
+
+        if self.has_images():
+            tokens += Message._IMAGE_TOKENS * len(self.images)
+
+        if self.has_files():
+            for file in self.files:
+                tokens += min(file.pages * Message._FILE_PAGE_TOKENS, Message._MAX_FILE_TOKENS)
+
+        return tokens
+
     # helper functions for to_dict
     def _files_to_dict_list(self) -> list[dict]:
 
@@ -58,7 +127,7 @@ class Message:
                 "type": "file",
                 "file": {
                     "filename": file.filename,
-                    "file_data": f"data:application/pdf;base64,{file.b64_file}"
+                    "file_data": file.data_url()
                 }
             })
 
@@ -81,6 +150,19 @@ class Message:
         return output
 
     def to_dict(self) -> dict:
+        """Returns the message in the form used by the OpenAI API. The result is
+        cached (until change_text_content is called), so it must not be modified.
+        Messages with files are rebuilt every time instead, so their data URLs are
+        only held by the attachment store (which can drop them to save memory)."""
+        if self.has_files():
+            return self._build_dict()
+
+        if self._dict is None:
+            self._dict = self._build_dict()
+
+        return self._dict
+
+    def _build_dict(self) -> dict:
         content_list = []
 
         if self.has_images():
@@ -94,7 +176,7 @@ class Message:
             "text": self.text_content
         })
 
-        return {"role": self.role, "content": content_list}
+        return {"role": self.role.value, "content": content_list}
 
 
 @final
@@ -104,6 +186,8 @@ class Image:
     use with the OpenAI API.
     """
 
+    __slots__ = ("url",)
+
     # base64 encoded image in UTF-8 format
     # b64_image: str
     # type: str
@@ -117,18 +201,39 @@ class Image:
 @final
 class File:
     """
-    Creates a file object from a bytes object, encoded in base64 to
-    use with the OpenAI API.
+    Creates a file object from an attachment held in an AttachmentStore. The
+    file's bytes are only encoded in base64 (to use with the OpenAI API) when a
+    request payload is built.
 
     Note: the API only supports PDF files, so by default all files are
     explicitly treated as PDF files.
     """
 
+    # __weakref__ is needed to release the attachment when the file is garbage collected
+    __slots__ = ("filename", "digest", "store", "__weakref__")
+
     filename: str
 
-    # base64 encoded file in UTF-8 format
-    b64_file: str
+    # SHA-256 digest of the file's bytes in the attachment store
+    digest: str
 
-    def __init__(self, filename: str, file_bytes: bytes) -> None:
+    def __init__(self, filename: str, digest: str, store: AttachmentStore) -> None:
+        # Takes over the store reference returned by AttachmentStore.put, and
+        # releases it once the file is garbage collected.
         self.filename = filename
-        self.b64_file = base64.b64encode(file_bytes).decode("utf-8")
+        self.digest = digest
+        self.store = store
+        weakref.finalize(self, store.release, digest)
+
+    @property
+    def size(self) -> int:
+        """Size of the file in bytes (before base64 encoding)."""
+        return self.store.size(self.digest)
+
+    @property
+    def pages(self) -> int:
+        return self.store.pages(self.digest)
+
+    def data_url(self) -> str:
+        """Base64 data URL of the file, shared with every other file with the same contents."""
+        return self.store.data_url(self.digest)
@@ -1,28 +1,55 @@
 from __future__ import annotations
 
-import requests
 import os
 
+from gateways.cache import TTLCache
+from gateways.http_client import PooledHTTPClient
 from gateways.singleton import Singleton
+from metrics.tracing import tracer
 
 
 class BraveSearchGateway(metaclass=Singleton):
     """A gateway to access the Brave Search API."""
 
     _BRAVE_SEARCH_API_KEY: str = os.environ.get("BRAVE_SEARCH_API_KEY")
-    _DEFAULT_GET_URL: str = "https://api.search.brave.com/res/v1/web/search"
+    _DEFAULT_BASE_URL: str = "https://api.search.brave.com"
 
     country: str
+    base_url: str
 
-    def __init__(self, country: str = None) -> None:
+    def __init__(self, country: str = None, http_client: PooledHTTPClient | None = None,
+                 cache_ttl: float | None = None, base_url: str | None = None) -> None:
         if country is None:
             self.country = "CA"
         else:
             self.country = country
 
-    def _search(self, query: str) -> list[dict]:
-        response = requests.get(
-            "https://api.search.brave.com/res/v1/web/search",
+        # The base URL can be pointed elsewhere (e.g. at a local stand-in server for load tests).
+        if base_url is None:
+            base_url = os.getenv("BRAVE_BASE_URL", BraveSearchGateway._DEFAULT_BASE_URL)
+
+        self.base_url = base_url.rstrip('/')
+
+        if http_client is None:
+            self.client = PooledHTTPClient()
+        else:
+            self.client = http_client
+
+        # Results for time-sensitive queries go stale quickly, so the TTL is kept short.
+        if cache_ttl is None:
+            cache_ttl = float(os.getenv("BRAVE_CACHE_TTL", 120))
+
+        self.cache = TTLCache(cache_ttl, int(os.getenv("BRAVE_CACHE_SIZE", 512)))
+
+    @staticmethod
+    def normalize_query(query: str) -> str:
+        """Folds case, whitespace and token order, so that e.g. "Super Bowl 2025"
+        and "2025  super bowl" share a cache entry."""
+        return ' '.join(sorted(query.lower().split()))
+
+    async def _search(self, query: str) -> list[dict]:
+        response = (await self.client.get(
+            f"{self.base_url}/res/v1/web/search",
             headers={
                 "Accept": "application/json",
                 "Accept-Encoding": "gzip",
@@ -34,16 +61,25 @@ class BraveSearchGateway(metaclass=Singleton):
                 "safesearch": "strict",
                 "count": 3
             },
-        ).json()
+        )).json()
 
         if len(response["web"]["results"]) > 3:
             return response["web"]["results"][:3]
 
         return response["web"]["results"]
 
-    def concise_search(self, query: str) -> list[dict]:
-        """Same as _search, but removes extra metadata from responses to reduce fluff."""
-        response = self._search(query)
+    @tracer.timed("brave.concise_search")
+    async def concise_search(self, query: str) -> list[dict]:
+        """Same as _search, but removes extra metadata from responses to reduce fluff.
+        Results are cached per normalized query and country."""
+        key = (BraveSearchGateway.normalize_query(query), self.country)
+
+        try:
+            return list(self.cache.get(key))
+        except KeyError:
+            pass
+
+        response = await self._search(query)
         concise_responses = []
         for result in response:
             concise_responses.append({
@@ -53,4 +89,6 @@ class BraveSearchGateway(metaclass=Singleton):
                 "hostname": result["meta_url"]["netloc"]
             })
 
-        return concise_responses
+        self.cache.set(key, concise_responses)
+
+        return list(concise_responses)
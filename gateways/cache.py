@@ -0,0 +1,238 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+import typing
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    Least-recently-used cache whose entries expire after a fixed time-to-live.
+
+    Used by the gateways to avoid repeating upstream requests whose results
+    don't change often. Keeps hit/miss counters and tracks how old the entries
+    it serves are, so TTLs can be tuned against freshness.
+    """
+
+    _TTL: float
+    _MAX_SIZE: int
+
+    def __init__(self, ttl: float, max_size: int = 256,
+                 clock: typing.Callable[[], float] = time.monotonic) -> None:
+        self._TTL = ttl
+        self._MAX_SIZE = max_size
+        self._clock = clock
+
+        # key -> (time stored, value), ordered from least to most recently used
+        self._entries: OrderedDict[typing.Hashable, tuple[float, typing.Any]] = OrderedDict()
+
+        self._hits = 0
+        self._misses = 0
+        self._expirations = 0
+        self._evictions = 0
+        self._total_hit_age = 0.0
+        self._last_hit_age = 0.0
+
+    @property
+    def ttl(self) -> float:
+        return self._TTL
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: typing.Hashable) -> typing.Any:
+        """Returns the cached value for key. Raises KeyError on a miss (or if the entry expired)."""
+        entry = self._entries.get(key)
+        if entry is None:
+            self._misses += 1
+            raise KeyError(key)
+
+        age = self._clock() - entry[0]
+        if age > self._TTL:
+            del self._entries[key]
+            self._expirations += 1
+            self._misses += 1
+            raise KeyError(key)
+
+        self._entries.move_to_end(key)
+        self._hits += 1
+        self._total_hit_age += age
+        self._last_hit_age = age
+
+        return entry[1]
+
+    def set(self, key: typing.Hashable, value: typing.Any) -> None:
+        self._entries[key] = (self._clock(), value)
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self._MAX_SIZE:
+            self._entries.popitem(last=False)
+            self._evictions += 1
+
+    def age(self, key: typing.Hashable) -> float | None:
+        """Returns how long ago the entry for key was stored, or None if not cached."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        return self._clock() - entry[0]
+
+    def invalidate(self, key: typing.Hashable | None = None) -> None:
+        """Removes the entry for key, or every entry if no key is given."""
+        if key is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(key, None)
+
+    def stats(self) -> dict[str, int | float]:
+        lookups = self._hits + self._misses
+        now = self._clock()
+
+        if self._entries:
+            oldest_age = now - min(stored for stored, _ in self._entries.values())
+        else:
+            oldest_age = 0.0
+
+        return {
+            "size": len(self._entries),
+            "max_size": self._MAX_SIZE,
+            "ttl": self._TTL,
+            "hits": self._hits,
+            "misses": self._misses,
+            "hit_rate": self._hits / lookups if lookups else 0.0,
+            "expirations": self._expirations,
+            "evictions": self._evictions,
+            "last_hit_age": self._last_hit_age,
+            "mean_hit_age": self._total_hit_age / self._hits if self._hits else 0.0,
+            "oldest_entry_age": oldest_age,
+        }
+
+
+class SQLiteCache:
+    """
+    Persistent key/value cache stored in a SQLite database, so entries survive
+    restarts. Values are stored as JSON, and entries expire after the TTL (if given).
+    Expired entries are purged when the cache is opened, then at most every
+    `purge_interval` seconds as entries are stored, so the database doesn't keep
+    growing with entries that are never read again.
+
+    Methods are blocking; TieredCache runs them off the event loop.
+    """
+
+    _TTL: float | None
+
+    def __init__(self, path: str, ttl: float | None = None, table: str = "cache",
+                 purge_interval: float = 3600) -> None:
+        self._TTL = ttl
+        self._table = table
+        self._purge_interval = purge_interval
+        self._lock = threading.Lock()
+
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute(f"CREATE TABLE IF NOT EXISTS {table} "
+                                     f"(key TEXT PRIMARY KEY, value TEXT NOT NULL, stored_at REAL NOT NULL)")
+
+        self._last_purge = time.monotonic()
+        self.purge_expired()
+
+    def get(self, key: str) -> typing.Any:
+        """Returns the cached value for key. Raises KeyError on a miss (or if the entry expired)."""
+        with self._lock:
+            row = self._connection.execute(f"SELECT value, stored_at FROM {self._table} WHERE key = ?",
+                                           (key,)).fetchone()
+
+        if row is None:
+            raise KeyError(key)
+
+        value, stored_at = row
+        if self._TTL is not None and time.time() - stored_at > self._TTL:
+            self.invalidate(key)
+            raise KeyError(key)
+
+        return json.loads(value)
+
+    def set(self, key: str, value: typing.Any) -> None:
+        with self._lock, self._connection:
+            self._connection.execute(f"INSERT OR REPLACE INTO {self._table} (key, value, stored_at) VALUES (?, ?, ?)",
+                                     (key, json.dumps(value), time.time()))
+
+        if time.monotonic() - self._last_purge >= self._purge_interval:
+            self._last_purge = time.monotonic()
+            self.purge_expired()
+
+    def invalidate(self, key: str | None = None) -> None:
+        """Removes the entry for key, or every entry if no key is given."""
+        with self._lock, self._connection:
+            if key is None:
+                self._connection.execute(f"DELETE FROM {self._table}")
+            else:
+                self._connection.execute(f"DELETE FROM {self._table} WHERE key = ?", (key,))
+
+    def purge_expired(self) -> int:
+        """Removes every expired entry, and returns how many were removed."""
+        if self._TTL is None:
+            return 0
+
+        with self._lock, self._connection:
+            cursor = self._connection.execute(f"DELETE FROM {self._table} WHERE stored_at < ?",
+                                              (time.time() - self._TTL,))
+        return cursor.rowcount
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+
+class TieredCache:
+    """
+    In-process TTLCache in front of an optional SQLiteCache. Misses in memory
+    fall through to disk, and disk hits are promoted back into memory.
+    """
+
+    def __init__(self, memory: TTLCache, disk: SQLiteCache | None = None) -> None:
+        self.memory = memory
+        self.disk = disk
+
+        self._disk_hits = 0
+        self._disk_misses = 0
+
+    async def get(self, key: str) -> typing.Any:
+        """Returns the cached value for key. Raises KeyError if neither tier has it."""
+        try:
+            return self.memory.get(key)
+        except KeyError:
+            if self.disk is None:
+                raise
+
+        try:
+            value = await asyncio.to_thread(self.disk.get, key)
+        except KeyError:
+            self._disk_misses += 1
+            raise
+
+        self._disk_hits += 1
+        self.memory.set(key, value)
+        return value
+
+    async def set(self, key: str, value: typing.Any) -> None:
+        self.memory.set(key, value)
+        if self.disk is not None:
+            await asyncio.to_thread(self.disk.set, key, value)
+
+    async def invalidate(self, key: str | None = None) -> None:
+        """Removes the entry for key from both tiers, or every entry if no key is given."""
+        self.memory.invalidate(key)
+        if self.disk is not None:
+            await asyncio.to_thread(self.disk.invalidate, key)
+
+    def stats(self) -> dict[str, int | float]:
+        output = self.memory.stats()
+        output["disk_enabled"] = self.disk is not None
+        output["disk_hits"] = self._disk_hits
+        output["disk_misses"] = self._disk_misses
+
+        return output
@@ -1,9 +1,14 @@
 from __future__ import annotations
 
-import requests
 import os
+import typing
 
+from gateways.cache import SQLiteCache
+from gateways.cache import TieredCache
+from gateways.cache import TTLCache
+from gateways.http_client import PooledHTTPClient
 from gateways.singleton import Singleton
+from metrics.tracing import tracer
 
 
 class GeniusAPIGateway(metaclass=Singleton):
@@ -11,16 +16,85 @@ class GeniusAPIGateway(metaclass=Singleton):
     lazy to implement the http requests myself."""
 
     _GENIUS_API_KEY = os.environ.get("GENIUS_API_KEY")
+    _DEFAULT_BASE_URL = "https://api.genius.com"
 
-    def get_song_info(self, song: str, artist: str) -> dict:
+    base_url: str
+
+    def __init__(self, http_client: PooledHTTPClient | None = None, cache: TieredCache | None = None,
+                 base_url: str | None = None) -> None:
+        # The base URL can be pointed elsewhere (e.g. at a local stand-in server for load tests).
+        if base_url is None:
+            base_url = os.getenv("GENIUS_BASE_URL", GeniusAPIGateway._DEFAULT_BASE_URL)
+
+        self.base_url = base_url.rstrip('/')
+
+        if http_client is None:
+            self.client = PooledHTTPClient()
+        else:
+            self.client = http_client
+
+        # Song and artist metadata rarely changes, so both the search -> id step and
+        # the id -> info step are cached. Set GENIUS_CACHE_PATH to also keep the
+        # cache on disk across restarts.
+        if cache is None:
+            memory = TTLCache(float(os.getenv("GENIUS_CACHE_TTL", 24 * 3600)),
+                              int(os.getenv("GENIUS_CACHE_SIZE", 1024)))
+
+            disk = None
+            if os.getenv("GENIUS_CACHE_PATH"):
+                disk = SQLiteCache(os.environ["GENIUS_CACHE_PATH"],
+                                   float(os.getenv("GENIUS_DISK_CACHE_TTL", 7 * 24 * 3600)),
+                                   table="genius")
+
+            cache = TieredCache(memory, disk)
+
+        self.cache = cache
+
+    @staticmethod
+    def _normalize(query: str) -> str:
+        return ' '.join(query.split()).lower()
+
+    async def _cached(self, key: str, lookup: typing.Callable[[], typing.Awaitable]) -> typing.Any:
         try:
-            response = requests.get(f"https://api.genius.com/search?q={song} {artist}&access_token={self._GENIUS_API_KEY}")
-            song_id = response.json()['response']['hits'][0]['result']['id']
+            return await self.cache.get(key)
+        except KeyError:
+            value = await lookup()
+            await self.cache.set(key, value)
+            return value
+
+    @tracer.timed("genius.get_song_info")
+    async def get_song_info(self, song: str, artist: str) -> dict:
+        song_id = await self._cached(f"song-search:{self._normalize(f'{song} {artist}')}",
+                                     lambda: self._search_song_id(song, artist))
+        song_info = await self._cached(f"song:{song_id}", lambda: self._song_info(song_id))
+
+        # Copy so callers can't modify the cached entry.
+        return dict(song_info)
+
+    @tracer.timed("genius.get_artist_info")
+    async def get_artist_info(self, artist: str) -> dict:
+        artist_id = await self._cached(f"artist-search:{self._normalize(artist)}",
+                                       lambda: self._search_artist_id(artist))
+        artist_info = await self._cached(f"artist:{artist_id}", lambda: self._artist_info(artist_id, artist))
+
+        return dict(artist_info)
+
+    async def invalidate(self, key: str | None = None) -> None:
+        """Removes a cached entry (e.g. "song:123"), or every cached entry if no key is given."""
+        await self.cache.invalidate(key)
+
+    # helper functions, which always hit the API
+
+    async def _search_song_id(self, song: str, artist: str) -> int:
+        try:
+            response = await self.client.get(f"{self.base_url}/search?q={song} {artist}&access_token={self._GENIUS_API_KEY}")
+            return response.json()['response']['hits'][0]['result']['id']
         except Exception:
             raise IOError(f"Could not find song {song} by {artist}")
 
-        song_info = requests.get(f"https://api.genius.com/songs/{song_id}?"
-                                 f"text_format=plain&access_token={self._GENIUS_API_KEY}").json()['response']['song']
+    async def _song_info(self, song_id: int) -> dict:
+        song_info = (await self.client.get(f"{self.base_url}/songs/{song_id}?"
+                                           f"text_format=plain&access_token={self._GENIUS_API_KEY}")).json()['response']['song']
 
         return {
             "title": song_info["full_title"],
@@ -32,13 +106,19 @@ class GeniusAPIGateway(metaclass=Singleton):
             "icon_url": song_info['album']['cover_art_url']
         }
 
-    def get_artist_info(self, artist: str) -> dict:
+    async def _search_artist_id(self, artist: str) -> int:
         try:
             # This will probably return a song.
-            song = requests.get(f"https://api.genius.com/search?q={artist}&access_token={self._GENIUS_API_KEY}").json()
-            artist_id = song['response']['hits'][0]['result']['primary_artist']['id']
-            artist_info = requests.get(f"https://api.genius.com/artists/{artist_id}?"
-                                     f"text_format=plain&access_token={self._GENIUS_API_KEY}").json()['response']['artist']
+            song = (await self.client.get(f"{self.base_url}/search?q={artist}&access_token={self._GENIUS_API_KEY}")).json()
+            return song['response']['hits'][0]['result']['primary_artist']['id']
+        except Exception as e:
+            print(e)
+            raise IOError(f"Could not find artist {artist}")
+
+    async def _artist_info(self, artist_id: int, artist: str) -> dict:
+        try:
+            artist_info = (await self.client.get(f"{self.base_url}/artists/{artist_id}?"
+                                                 f"text_format=plain&access_token={self._GENIUS_API_KEY}")).json()['response']['artist']
         except Exception as e:
             print(e)
             raise IOError(f"Could not find artist {artist}")
@@ -54,4 +134,3 @@ class GeniusAPIGateway(metaclass=Singleton):
             "instagram": artist_info["instagram_name"],
             "twitter": artist_info["twitter_name"]
         }
-
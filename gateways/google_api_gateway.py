@@ -1,11 +1,14 @@
 from __future__ import annotations
 
+import json
+import os
 from datetime import datetime
 
 from google import genai
 from google.genai import types
 
 from gateways.singleton import Singleton
+from metrics.tracing import tracer
 
 
 # NOTE: The API key is retrieved from the environment variable `GEMINI_API_KEY`.
@@ -19,9 +22,17 @@ class GoogleAPIGateway(metaclass=Singleton):
     """
     _MODEL: str
 
-    def __init__(self, model: str = "gemini-2.5-flash-lite"):
+    def __init__(self, model: str = "gemini-2.5-flash-lite", base_url: str | None = None):
         self._MODEL = model
-        self.client = genai.Client()
+
+        # The base URL can be pointed elsewhere (e.g. at a local stand-in server for load tests).
+        if base_url is None:
+            base_url = os.getenv("GEMINI_BASE_URL")
+
+        if base_url is None:
+            self.client = genai.Client()
+        else:
+            self.client = genai.Client(http_options=types.HttpOptions(base_url=base_url))
 
     @property
     def model(self) -> str:
@@ -31,9 +42,10 @@ class GoogleAPIGateway(metaclass=Singleton):
     def model(self, model: str) -> None:
         self._MODEL = model
 
-    def generate_response(self, instructions: str, content: str) -> str:
+    @tracer.timed("gemini.generate_response")
+    async def generate_response(self, instructions: str, content: str) -> str:
         """Main method to generate responses from Google's Gemini API"""
-        response = self.client.models.generate_content(
+        response = await self.client.aio.models.generate_content(
             model=self._MODEL,
             config=types.GenerateContentConfig(
                 system_instruction=instructions,
@@ -44,6 +56,22 @@ class GoogleAPIGateway(metaclass=Singleton):
 
         return response.text
 
+    @tracer.timed("gemini.generate_json_response")
+    async def generate_json_response(self, instructions: str, content: str, schema: types.Schema) -> dict:
+        """Same as generate_response, but constrains the output to JSON matching the given schema."""
+        response = await self.client.aio.models.generate_content(
+            model=self._MODEL,
+            config=types.GenerateContentConfig(
+                system_instruction=instructions,
+                thinking_config=types.ThinkingConfig(thinking_budget=0),
+                response_mime_type="application/json",
+                response_schema=schema,
+            ),
+            contents=content
+        )
+
+        return json.loads(response.text)
+
     # All method below are to generate responses in regards with prompt engineering to refine the output.
 
     flags = """
@@ -87,7 +115,7 @@ class GoogleAPIGateway(metaclass=Singleton):
     lacks the --music flag as that is a matter of personal opinion.
     """
 
-    def get_flags(self, content: str) -> str:
+    async def get_flags(self, content: str) -> str:
         """Searches message content to get flags"""
 
         instructions = f"""
@@ -100,9 +128,68 @@ class GoogleAPIGateway(metaclass=Singleton):
         A response would be: "--web".
         """
 
-        return self.generate_response(instructions, content)
+        return await self.generate_response(instructions, content)
+
+    route_schema = types.Schema(
+        type=types.Type.OBJECT,
+        properties={
+            "flag": types.Schema(type=types.Type.STRING,
+                                 enum=["--song", "--artist", "--weather", "--web", "--logic", "--none"]),
+            "search_term": types.Schema(type=types.Type.STRING),
+            "locations": types.Schema(type=types.Type.ARRAY, items=types.Schema(
+                type=types.Type.OBJECT,
+                properties={
+                    "city": types.Schema(type=types.Type.STRING),
+                    "country": types.Schema(type=types.Type.STRING),
+                },
+                required=["city", "country"],
+            )),
+            "song_name": types.Schema(type=types.Type.STRING),
+            "song_artists": types.Schema(type=types.Type.ARRAY, items=types.Schema(type=types.Type.STRING)),
+            "artist": types.Schema(type=types.Type.STRING),
+        },
+        required=["flag"],
+    )
+
+    async def route(self, content: str) -> dict:
+        """Chooses a flag for the message content and extracts the arguments its
+        integration needs in a single call, instead of get_flags followed by one of
+        the methods below. Returns a dict following route_schema, where only "flag"
+        is guaranteed to be present."""
 
-    def search_engine_optimization(self, content: str) -> str:
+        instructions = f"""
+        Search the content below and choose one flag for it.
+        The flags all start with two dashes, "--", and are listed below:
+        
+        {GoogleAPIGateway.flags}
+        
+        Then, fill in only the fields needed by the chosen flag:
+        
+        --web:      "search_term", an SEO term for one web search that can answer the user's query.
+                    Any references to time should be included in the SEO term. Today is
+                    {datetime.strftime(datetime.now(), '%Y-%m-%d')} in Y/M/D format. So, for example, if the query is
+                    'who won the super bowl this year?', the search term would be 'super bowl {datetime.strftime(datetime.now(), '%Y')}'.
+        
+        --weather:  "locations", every city the user wants the weather for, each with its "city" and its two
+                    letter "country" code. For example, "tell me about the weather in Toronto" would give
+                    [{{"city": "Toronto", "country": "CA"}}], and "is it warmer in Toronto or Vancouver?" would give
+                    [{{"city": "Toronto", "country": "CA"}}, {{"city": "Vancouver", "country": "CA"}}].
+        
+        --song:     "song_name" and "song_artists", the song's name and its artists.
+                    If the prompt starts with (The user is playing...) but they mention a different track
+                    later on, disregard the (The user is playing...) message at the top.
+        
+        --artist:   "artist", the main artist mentioned.
+        
+        If the information for a field can't be found, leave it out.
+        """
+
+        output = await self.generate_json_response(instructions, content, GoogleAPIGateway.route_schema)
+
+        # Drop empty fields, so callers can fall back to the dedicated methods below.
+        return {key: value for key, value in output.items() if value}
+
+    async def search_engine_optimization(self, content: str) -> str:
         """Takes in message content and converts it into an SEO term for web
         searches (for messages that have the web search flag.)"""
 
@@ -113,9 +200,9 @@ class GoogleAPIGateway(metaclass=Singleton):
                         f"So, for example, if the query is"
                         f"'who won the super bowl this year?', the response would be 'super bowl {datetime.strftime(datetime.now(), '%Y')}'.")
 
-        return self.generate_response(instructions, content)
+        return await self.generate_response(instructions, content)
 
-    def attain_song_information(self, content: str) -> str:
+    async def attain_song_information(self, content: str) -> str:
         """Takes in message content about a song, and then determine the song's
         name and artist"""
 
@@ -133,14 +220,14 @@ class GoogleAPIGateway(metaclass=Singleton):
         If no song information can be found, the output would be "none".
         """
 
-        output = self.generate_response(instructions, content)
+        output = await self.generate_response(instructions, content)
 
         if output == "none":
             raise IOError("No song information found.")
 
         return output
 
-    def attain_artist_information(self, content: str) -> str:
+    async def attain_artist_information(self, content: str) -> str:
         """Takes in message content about a song, and then determine the song's
         name and artist"""
 
@@ -153,31 +240,41 @@ class GoogleAPIGateway(metaclass=Singleton):
         If no artist information can be found, the output would be "none".
         """
 
-        output = self.generate_response(instructions, content)
+        output = await self.generate_response(instructions, content)
 
         if output == "none":
             raise IOError("No artist information found.")
 
         return output
 
-    def attain_location_information(self, content) -> str:
-        """Takes in message content about a weather query, and then determines the location information to parse said
-        weather query. If none found, raises IOError."""
+    async def attain_location_information(self, content) -> list[tuple[str, str]]:
+        """Takes in message content about a weather query, and then determines the locations (as city and
+        country code pairs) to parse said weather query. If none found, raises IOError."""
 
         instructions = """
-        Read the content of the user message and determine the location they want access to.
-        The output notation should be as follows:
+        Read the content of the user message and determine the locations they want access to.
+        The output notation should be as follows, with one line per location:
         city_name, two_letter_country_code
         
         For example, if the user query said "tell me about the weather in Toronto", the output would be:
         Toronto, CA
         
+        And if the user query said "is it warmer in Toronto or Vancouver?", the output would be:
+        Toronto, CA
+        Vancouver, CA
+        
         If no city can be found, the output should be only "none".
         """
 
-        output = self.generate_response(instructions, content)
+        output = await self.generate_response(instructions, content)
 
-        if output == "none":
+        locations = []
+        for line in output.splitlines():
+            city, _, country = line.rpartition(',')
+            if city.strip() and country.strip():
+                locations.append((city.strip(), country.strip()))
+
+        if not locations:
             raise IOError("No location data found")
 
-        return output
+        return locations
@@ -0,0 +1,102 @@
+from __future__ import annotations
+
+import importlib.util
+import os
+
+import httpx
+
+
+def _env_float(name: str, default: float) -> float:
+    return float(os.getenv(name, default))
+
+
+class PooledHTTPClient:
+    """
+    Keep-alive HTTP client owned by a single gateway.
+
+    Each gateway only talks to one upstream host, so the connection limits of
+    the pool are effectively per-host limits. Connections are kept alive and
+    reused between lookups, and HTTP/2 is used when enabled and the `h2`
+    package is installed.
+
+    Defaults can be changed per deployment with the following environment variables:
+    HTTP_MAX_CONNECTIONS_PER_HOST, HTTP_MAX_KEEPALIVE_CONNECTIONS, HTTP_KEEPALIVE_EXPIRY,
+    HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT and HTTP2 ("1" to enable).
+    """
+
+    def __init__(self, max_connections: int | None = None, max_keepalive_connections: int | None = None,
+                 keepalive_expiry: float | None = None, connect_timeout: float | None = None,
+                 read_timeout: float | None = None, http2: bool | None = None) -> None:
+        if max_connections is None:
+            max_connections = int(os.getenv("HTTP_MAX_CONNECTIONS_PER_HOST", 10))
+
+        if max_keepalive_connections is None:
+            max_keepalive_connections = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", max_connections))
+
+        if keepalive_expiry is None:
+            keepalive_expiry = _env_float("HTTP_KEEPALIVE_EXPIRY", 30)
+
+        if connect_timeout is None:
+            connect_timeout = _env_float("HTTP_CONNECT_TIMEOUT", 5)
+
+        if read_timeout is None:
+            read_timeout = _env_float("HTTP_READ_TIMEOUT", 15)
+
+        if http2 is None:
+            http2 = os.getenv("HTTP2", "0") == "1"
+
+        # HTTP/2 support in httpx is optional, and requires the h2 package.
+        self.http2 = http2 and importlib.util.find_spec("h2") is not None
+
+        self.client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=max_connections,
+                                max_keepalive_connections=max_keepalive_connections,
+                                keepalive_expiry=keepalive_expiry),
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            http2=self.http2,
+        )
+
+        self._requests = 0
+        self._in_flight = 0
+        self._connections_opened = 0
+        self._http2_requests = 0
+        self._errors = 0
+
+    async def get(self, url: str, **kwargs) -> httpx.Response:
+        self._requests += 1
+        self._in_flight += 1
+
+        try:
+            response = await self.client.get(url, extensions={"trace": self._trace}, **kwargs)
+        except httpx.HTTPError:
+            self._errors += 1
+            raise
+        finally:
+            self._in_flight -= 1
+
+        if response.http_version == "HTTP/2":
+            self._http2_requests += 1
+
+        return response
+
+    async def _trace(self, event_name: str, info: dict) -> None:
+        # Only fires when the pool has to open a new connection, so every other
+        # request was served over a kept-alive connection.
+        if event_name == "connection.connect_tcp.complete":
+            self._connections_opened += 1
+
+    def stats(self) -> dict[str, int | float]:
+        reused = max(self._requests - self._connections_opened, 0)
+
+        return {
+            "requests": self._requests,
+            "in_flight": self._in_flight,
+            "connections_opened": self._connections_opened,
+            "connections_reused": reused,
+            "reuse_ratio": reused / self._requests if self._requests else 0.0,
+            "http2_requests": self._http2_requests,
+            "errors": self._errors,
+        }
+
+    async def aclose(self) -> None:
+        await self.client.aclose()
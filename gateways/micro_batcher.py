@@ -0,0 +1,99 @@
+from __future__ import annotations
+
+import asyncio
+import typing
+from collections import Counter
+
+
+class MicroBatcher:
+    """
+    Collects requests made concurrently within a short window, and sends them
+    upstream as one call. Each caller gets back its own item's result.
+
+    `send` takes a list of items and must return a list of results in the same order.
+    A batch is sent once it reaches `max_batch_size` items, or `max_wait` seconds
+    after its first item arrived, whichever comes first.
+    """
+
+    def __init__(self, send: typing.Callable[[list], typing.Awaitable[list]],
+                 max_batch_size: int = 32, max_wait: float = 0.005) -> None:
+        self._send = send
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+
+        self._pending: list[tuple[typing.Any, asyncio.Future]] = []
+        self._timer: asyncio.TimerHandle | None = None
+        self._in_flight: set[asyncio.Task] = set()
+
+        self._batch_sizes = Counter()
+
+    async def submit(self, item: typing.Any) -> typing.Any:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future))
+
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+
+        return await future
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        # Callers that gave up (were cancelled) are left out of the batch.
+        batch = [(item, future) for item, future in self._pending[:self.max_batch_size] if not future.done()]
+        self._pending = self._pending[self.max_batch_size:]
+
+        if self._pending:
+            self._timer = asyncio.get_running_loop().call_later(self.max_wait, self._flush)
+
+        if not batch:
+            return
+
+        task = asyncio.create_task(self._send_batch(batch))
+        self._in_flight.add(task)
+        task.add_done_callback(self._in_flight.discard)
+
+    async def _send_batch(self, batch: list[tuple[typing.Any, asyncio.Future]]) -> None:
+        self._batch_sizes[len(batch)] += 1
+
+        try:
+            results = await self._send([item for item, _ in batch])
+            if len(results) != len(batch):
+                raise RuntimeError(f"Batch of {len(batch)} items returned {len(results)} results")
+        except BaseException as e:
+            # Whatever went wrong (including this task being cancelled), every caller
+            # still waiting is given an exception, so none of them waits forever.
+            error = e
+            if not isinstance(e, Exception):
+                error = RuntimeError("Batch was interrupted")
+                error.__cause__ = e
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(error)
+            if error is not e:
+                raise
+            return
+
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    def stats(self) -> dict[str, typing.Any]:
+        batches = sum(self._batch_sizes.values())
+        items = sum(size * count for size, count in self._batch_sizes.items())
+
+        return {
+            "batches": batches,
+            "items": items,
+            "mean_batch_size": items / batches if batches else 0.0,
+            "largest_batch_size": max(self._batch_sizes, default=0),
+            "batch_size_counts": dict(sorted(self._batch_sizes.items())),
+            "pending": len(self._pending),
+            "max_batch_size": self.max_batch_size,
+            "max_wait": self.max_wait,
+        }
@@ -1,7 +1,13 @@
 from __future__ import annotations
-from openai import OpenAI
 
+import os
+import typing
+
+from openai import AsyncOpenAI
+
+from gateways.micro_batcher import MicroBatcher
 from gateways.singleton import Singleton
+from metrics.tracing import tracer
 
 # NOTE: The API key is retrieved from the environment variable `OPENAI_API_KEY`.
 class OpenAIGateway(metaclass=Singleton):
@@ -13,10 +19,21 @@ class OpenAIGateway(metaclass=Singleton):
     _MODEL: str
     _REASONING: str
 
-    def __init__(self, model: str = "gpt-5-nano", reasoning: str = "low"):
+    def __init__(self, model: str = "gpt-5-nano", reasoning: str = "low",
+                 moderation_batch_size: int | None = None, moderation_batch_wait: float | None = None):
         self._MODEL = model
         self._REASONING = reasoning
-        self.client = OpenAI()
+        self.client = AsyncOpenAI()
+
+        # Moderation is the most frequent upstream call, so concurrent requests are
+        # collected for a few milliseconds and sent as a single call.
+        if moderation_batch_size is None:
+            moderation_batch_size = int(os.getenv("MODERATION_BATCH_SIZE", 32))
+
+        if moderation_batch_wait is None:
+            moderation_batch_wait = float(os.getenv("MODERATION_BATCH_WAIT_MS", 5)) / 1000
+
+        self.moderation_batcher = MicroBatcher(self._moderate_batch, moderation_batch_size, moderation_batch_wait)
 
     @property
     def model(self) -> str:
@@ -26,18 +43,63 @@ class OpenAIGateway(metaclass=Singleton):
     def model(self, model: str) -> None:
         self._MODEL = model
 
-    def change_reasoning(self, reasoning: str) -> None:
-        self._REASONING = reasoning
+    @property
+    def reasoning(self) -> str:
+        return self._REASONING
+
+    async def generate_response(self, messages: list, model: str | None = None, reasoning: str | None = None,
+                                instructions: str | None = None) -> str:
+        """
+        Generates a response to the messages. The model, reasoning effort and system
+        instructions can be overridden for this call only (defaulting to the gateway's
+        model and reasoning, and the instructions already in `messages`), so requests
+        with different settings can safely run concurrently.
+        """
+        response, _ = await self.generate_response_with_usage(messages, model, reasoning, instructions)
+        return response
+
+    @tracer.timed("openai.generate_response")
+    async def generate_response_with_usage(self, messages: list, model: str | None = None,
+                                           reasoning: str | None = None,
+                                           instructions: str | None = None) -> tuple[str, int]:
+        """Same as generate_response, but also returns the total number of tokens used."""
+        response = await self.client.chat.completions.create(
+            **self._request_options(messages, model, reasoning, instructions)
+        )
+
+        total_tokens = response.usage.total_tokens if response.usage is not None else 0
+        return response.choices[0].message.content, total_tokens
 
-    def generate_response(self, messages: list) -> str:
-        response = self.client.chat.completions.create(
-            model=self._MODEL,
-            messages=messages
+    @tracer.timed("openai.stream_response")
+    async def stream_response(self, messages: list, model: str | None = None, reasoning: str | None = None,
+                              instructions: str | None = None) -> typing.AsyncIterator[str]:
+        """Same as generate_response, but yields the response text piece by piece as it's generated."""
+        stream = await self.client.chat.completions.create(
+            **self._request_options(messages, model, reasoning, instructions),
+            stream=True
         )
 
-        return response.choices[0].message.content
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+    def _request_options(self, messages: list, model: str | None, reasoning: str | None,
+                         instructions: str | None) -> dict[str, typing.Any]:
+        if instructions is not None:
+            # The caller's list (and its system message) may be shared, so it's copied rather than modified.
+            system_message = {"role": "system", "content": [{"type": "text", "text": instructions}]}
+            if messages and messages[0]["role"] == "system":
+                messages = [system_message] + messages[1:]
+            else:
+                messages = [system_message] + messages
 
-    def moderation_filter(self, message: str) -> bool:
+        return {
+            "model": model if model is not None else self._MODEL,
+            "reasoning_effort": reasoning if reasoning is not None else self._REASONING,
+            "messages": messages,
+        }
+
+    async def moderation_filter(self, message: str) -> bool:
         # Manual override to troll
         if "femboy" in message:
             return False
@@ -49,15 +111,20 @@ class OpenAIGateway(metaclass=Singleton):
             return False
 
         # returns True if the content is explicit.
-        response = self.client.moderations.create(
-            model="omni-moderation-latest",
-            input=message,
-        ).to_dict()
-
-        scores = response['results'][0]['category_scores']
+        scores = await self.moderation_batcher.submit(message)
 
         for category in scores:
             if scores[category] > 0.1:
                 return True
 
         return False
+
+    @tracer.timed("openai.moderate_batch")
+    async def _moderate_batch(self, messages: list[str]) -> list[dict]:
+        # returns the category scores for each message, in order.
+        response = (await self.client.moderations.create(
+            model="omni-moderation-latest",
+            input=messages,
+        )).to_dict()
+
+        return [result['category_scores'] for result in response['results']]
@@ -2,17 +2,53 @@ from __future__ import annotations
 
 from datetime import datetime
 from datetime import timezone
-import requests
 import os
 
+from gateways.cache import TTLCache
+from gateways.http_client import PooledHTTPClient
 from gateways.singleton import Singleton
+from metrics.tracing import tracer
 
 
 class WeatherAPIGateway(metaclass=Singleton):
-    """Gateway to access the OpenWeatherMap API."""
+    """Gateway to access the OpenWeatherMap API.
+
+    OpenWeatherMap only refreshes current conditions about every 10 minutes, so
+    lookups are cached per location and units for WEATHER_CACHE_TTL seconds."""
 
     _WEATHER_API_KEY: str = os.environ['WEATHER_API_KEY']
-    
+    _DEFAULT_BASE_URL: str = "https://api.openweathermap.org"
+
+    base_url: str
+
+    def __init__(self, http_client: PooledHTTPClient | None = None,
+                 cache_ttl: float | None = None, cache_size: int | None = None,
+                 base_url: str | None = None) -> None:
+        # The base URL can be pointed elsewhere (e.g. at a local stand-in server for load tests).
+        if base_url is None:
+            base_url = os.getenv("WEATHER_BASE_URL", WeatherAPIGateway._DEFAULT_BASE_URL)
+
+        self.base_url = base_url.rstrip('/')
+
+        if http_client is None:
+            self.client = PooledHTTPClient()
+        else:
+            self.client = http_client
+
+        if cache_ttl is None:
+            cache_ttl = float(os.getenv("WEATHER_CACHE_TTL", 600))
+
+        if cache_size is None:
+            cache_size = int(os.getenv("WEATHER_CACHE_SIZE", 256))
+
+        self.cache = TTLCache(cache_ttl, cache_size)
+
+    @staticmethod
+    def normalize_location(location: str) -> str:
+        """Normalizes a "city,country" string, so that e.g. "Toronto, CA" and
+        "toronto,ca" share a cache entry."""
+        return ','.join(' '.join(part.split()).lower() for part in location.split(','))
+
     @staticmethod
     def get_wind_direction(deg: float) -> str:
         if 22.5 < deg <= 67.5:
@@ -41,9 +77,22 @@ class WeatherAPIGateway(metaclass=Singleton):
 
         return wind_direction
 
-    def weather_lookup(self, location: str, units: str = 'metric') -> dict:
-        response = requests.get(f"https://api.openweathermap.org/data/2.5/weather?q="
-                                f"{location}&appid={WeatherAPIGateway._WEATHER_API_KEY}&units={units}")
+    @tracer.timed("weather.weather_lookup")
+    async def weather_lookup(self, location: str, units: str = 'metric') -> dict:
+        key = (WeatherAPIGateway.normalize_location(location), units)
+
+        try:
+            weather = self.cache.get(key)
+        except KeyError:
+            weather = await self._weather_lookup(location, units)
+            self.cache.set(key, weather)
+
+        # Copy so callers can't modify the cached entry.
+        return dict(weather)
+
+    async def _weather_lookup(self, location: str, units: str) -> dict:
+        response = await self.client.get(f"{self.base_url}/data/2.5/weather?q="
+                                         f"{location}&appid={WeatherAPIGateway._WEATHER_API_KEY}&units={units}")
 
         if response.status_code != 200:
             raise IOError(f"Error retrieving weather data: {response.status_code}")
@@ -1,9 +1,11 @@
 from __future__ import annotations
 
 import asyncio
+import contextvars
 import functools
 import os
 import random
+import time
 import typing
 from datetime import datetime
 
@@ -13,7 +15,9 @@ import pycountry
 from discord import app_commands, Spotify
 from discord import Embed
 
+from dialogue.attachment_store import AttachmentStore
 from dialogue.conversation import Conversation
+from dialogue.conversation_registry import ConversationRegistry
 from dialogue.message import Message
 from dialogue.message import Image
 from dialogue.message import File
@@ -24,33 +28,74 @@ from gateways.openai_api_gateway import OpenAIGateway
 from gateways.brave_search_gateway import BraveSearchGateway
 from gateways.weather_api_gateway import WeatherAPIGateway
 from gateways.genius_api_gateway import GeniusAPIGateway
+from gateways.cache import TTLCache
+
+from metrics.server import MetricsServer
+from metrics.tracing import TraceLog
+from metrics.tracing import tracer
+
+from routing.intent_classifier import FLAGS
+from routing.intent_classifier import IntentClassifier
+from routing.intent_classifier import RoutingLog
+from routing.spotify import SpotifyPrefetcher
+from routing.spotify import refers_to_current_track
+from routing.spotify import spotify_activity
+from routing.wake_words import WakeWordMatcher
+from routing.wake_words import WakeWords
+
+from scheduling.fair_scheduler import FairScheduler
+from scheduling.fair_scheduler import SchedulerOverloaded
 
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 
 ALIASES = ["speeb", "speebot", "speebgpt"]
 WAKE_UP = ["hi", "hey", "heya", "good *", "whats up", "yo", "hello", "happy *"]
 
+# Default aliases and greetings. Guilds can have their own, given in the JSON file at
+# WAKE_WORDS_PATH (see routing/wake_words.py for the format).
+if os.getenv("WAKE_WORDS_PATH"):
+    wake_words = WakeWords.load(os.environ["WAKE_WORDS_PATH"], ALIASES, WAKE_UP)
+else:
+    wake_words = WakeWords(WakeWordMatcher(ALIASES, WAKE_UP))
+
 DISCLAIMER = "\n-# SpeebGPT can make mistakes. [Find out more.](<https://github.com/Speeb04/SpeebGPT-Enhanced/blob/main/README.md#privacy-notice>)"
 
 PROJECT_URL = "https://github.com/Speeb04/SpeebGPT-Enhanced"
 
-# Logger for conversation history.
-# Each entry is in the form of:
-#
-# {
-#     "conversation": Conversation,
-#     "message_history": list[int]
-# }
-#
+# Instructions used (in place of the conversation's) for --logic responses, to allow for longer responses.
+LOGICAL_INSTRUCTIONS = """
+    You are a helpful assistant named Speebot.
+    Give sassy and concise, but helpful responses. (Try and limit yourself to under 500 words.)
+    Use the instructions given by the system to help form responses.
+    """
+
+# Token budget for each conversation (estimated locally); the oldest messages are
+# dropped once a conversation goes over it.
+CONVERSATION_MAX_TOKENS = int(os.getenv("CONVERSATION_MAX_TOKENS", 8000))
 
-conversations_history: list[dict[str, Conversation | list[int]]] = []
+# Registry of live conversations, indexed by the ids of their Discord messages.
+# Idle conversations are dropped after CONVERSATION_TTL seconds, and the least
+# recently used ones are dropped once CONVERSATION_MAX_BYTES is exceeded.
+conversation_registry = ConversationRegistry(
+    ttl=float(os.getenv("CONVERSATION_TTL", 3600)),
+    max_bytes=int(os.getenv("CONVERSATION_MAX_BYTES", 64 * 1024 * 1024)),
+)
 
 intents = discord.Intents.default()
 intents.members = True
 intents.message_content = True
 intents.presences = True
 
-client = discord.Client(intents=intents)
+# In a sharded deployment (see sharding/supervisor.py), each worker process runs the shards
+# in SHARD_IDS (comma separated) out of SHARD_COUNT. A guild always belongs to the same shard,
+# so each worker only sees, and keeps the conversations of, its own guilds.
+SHARD_IDS = [int(shard_id) for shard_id in os.environ["SHARD_IDS"].split(",")] if os.getenv("SHARD_IDS") else None
+
+if os.getenv("SHARD_COUNT"):
+    client = discord.AutoShardedClient(intents=intents, shard_count=int(os.environ["SHARD_COUNT"]),
+                                       shard_ids=SHARD_IDS)
+else:
+    client = discord.Client(intents=intents)
 tree = app_commands.CommandTree(client=client)
 
 # Gateways for API usage - implements singleton anyway so only one instance should occur.
@@ -61,6 +106,116 @@ brave_search_gateway = BraveSearchGateway()
 weather_gateway = WeatherAPIGateway()
 genius_gateway = GeniusAPIGateway()
 
+# Whether responses are streamed into the reply as they're generated, and how often
+# (in seconds and moderated characters) the reply is updated while streaming.
+STREAM_RESPONSES = os.getenv("STREAM_RESPONSES", "1") == "1"
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", 1.0))
+STREAM_MODERATION_CHUNK = int(os.getenv("STREAM_MODERATION_CHUNK", 200))
+
+# Weather questions can compare several locations, at most MAX_WEATHER_LOCATIONS of which are
+# looked up, WEATHER_LOOKUP_CONCURRENCY at a time.
+MAX_WEATHER_LOCATIONS = int(os.getenv("MAX_WEATHER_LOCATIONS", 5))
+WEATHER_LOOKUP_CONCURRENCY = int(os.getenv("WEATHER_LOOKUP_CONCURRENCY", 4))
+
+# Shared, content-addressed storage for PDF attachments. PDFs larger than
+# MAX_ATTACHMENT_BYTES are ignored, and raw bytes beyond ATTACHMENT_MEMORY_BYTES
+# are moved to temporary files.
+MAX_ATTACHMENT_BYTES = int(os.getenv("MAX_ATTACHMENT_BYTES", 32 * 1024 * 1024))
+attachment_store = AttachmentStore(
+    max_memory_bytes=int(os.getenv("ATTACHMENT_MEMORY_BYTES", 256 * 1024 * 1024)),
+    spill_threshold=int(os.getenv("ATTACHMENT_SPILL_BYTES", 16 * 1024 * 1024)),
+)
+
+# Bounds how many messages are responded to at once, sharing the slots fairly between
+# guilds (weighted by SCHEDULER_GUILD_WEIGHTS, as "guild_id:weight,...") and their users.
+# Messages that can't be queued get SHED_RESPONSE as a reply (if it isn't empty).
+scheduler = FairScheduler(
+    max_concurrency=int(os.getenv("SCHEDULER_MAX_CONCURRENCY", 8)),
+    max_queue_per_user=int(os.getenv("SCHEDULER_MAX_QUEUE_PER_USER", 3)),
+    max_queued=int(os.getenv("SCHEDULER_MAX_QUEUED", 100)),
+    guild_weights={int(guild_id): float(weight) for guild_id, weight in
+                   (entry.split(":") for entry in os.getenv("SCHEDULER_GUILD_WEIGHTS", "").split(",") if entry)},
+)
+SHED_RESPONSE = os.getenv("SCHEDULER_SHED_RESPONSE", "> I'm a little overwhelmed right now, try again in a moment!")
+
+# Messages fetched over REST when resolving replies, so that repeated replies to
+# the same message don't fetch it again.
+fetched_messages = TTLCache(float(os.getenv("FETCHED_MESSAGE_CACHE_TTL", 300)),
+                            int(os.getenv("FETCHED_MESSAGE_CACHE_SIZE", 512)))
+
+# Local fast path for flag routing. Set INTENT_MODEL_PATH to a model trained with
+# routing/train_intent_classifier.py; without one, only the keyword rules are used.
+if os.getenv("INTENT_MODEL_PATH"):
+    intent_classifier = IntentClassifier.load(os.environ["INTENT_MODEL_PATH"])
+else:
+    intent_classifier = IntentClassifier()
+
+# Whether Gemini picks the flag and extracts its arguments in one structured call,
+# rather than one call for the flag and another for the arguments.
+COMBINED_ROUTING = os.getenv("COMBINED_ROUTING", "1") == "1"
+
+# If set, routing decisions made by Gemini are logged to ROUTING_LOG_PATH as training data.
+# So the fast path can be evaluated too, Gemini also routes a ROUTING_SHADOW_RATE fraction of
+# the messages routed locally, in the background, and both flags are logged.
+routing_log = RoutingLog(os.environ["ROUTING_LOG_PATH"]) if os.getenv("ROUTING_LOG_PATH") else None
+ROUTING_SHADOW_RATE = float(os.getenv("ROUTING_SHADOW_RATE", 0))
+shadow_routing_tasks: set[asyncio.Task] = set()
+
+# --song and --artist questions about what the user is listening to ("what's this song?") use
+# their Spotify activity directly. With SPOTIFY_PREFETCH=1, the Genius metadata of tracks that
+# users who recently talked to the bot are listening to is fetched as soon as they start playing.
+spotify_prefetcher = None
+if os.getenv("SPOTIFY_PREFETCH", "0") == "1":
+    spotify_prefetcher = SpotifyPrefetcher(genius_gateway,
+                                           active_ttl=float(os.getenv("SPOTIFY_PREFETCH_ACTIVE_TTL", 3600)),
+                                           concurrency=int(os.getenv("SPOTIFY_PREFETCH_CONCURRENCY", 4)))
+
+# Each message is traced through its stages (and gateway calls), tagged by route, guild and
+# outcome. If METRICS_PORT is set, the timings are served as Prometheus histograms at
+# http://METRICS_HOST:METRICS_PORT/metrics, along with the stats of the components below.
+# If TRACE_LOG_PATH is set, each message's trace is also logged there as a JSON line.
+# Set METRICS_GUILD_LABELS=0 to leave guild ids out of the histograms' labels, and the scheduler's per-guild stats out.
+metrics_server = None
+if os.getenv("METRICS_PORT"):
+    metrics_server = MetricsServer(tracer.registry, os.getenv("METRICS_HOST", "127.0.0.1"),
+                                   int(os.environ["METRICS_PORT"]))
+
+tracer.guild_label = os.getenv("METRICS_GUILD_LABELS", "1") == "1"
+
+if os.getenv("TRACE_LOG_PATH"):
+    tracer.trace_log = TraceLog(os.environ["TRACE_LOG_PATH"])
+
+# For guilds listed in SPECULATIVE_RESPONSES (comma separated guild ids, or "1" for every guild),
+# a general response is generated while the message is being routed. It's used if the message
+# turns out to be --none, and cancelled (or discarded) otherwise, trading tokens for latency.
+_speculative_responses = os.getenv("SPECULATIVE_RESPONSES", "0")
+SPECULATE_IN_ALL_GUILDS = _speculative_responses == "1"
+SPECULATIVE_GUILDS = {int(guild_id) for guild_id in _speculative_responses.split(",")
+                      if guild_id.strip() not in ("", "0", "1")}
+
+speculation_results = tracer.registry.counter(
+    "speebgpt_speculations_total",
+    "Speculative responses by result: used (hit), discarded for another route (miss), "
+    "abandoned along with the message (aborted), or failed.", ("guild", "result"))
+speculation_wasted_tokens = tracer.registry.counter(
+    "speebgpt_speculation_wasted_tokens_total",
+    "Tokens used by speculative responses that were discarded (estimated for cancelled ones).", ("guild",))
+
+tracer.registry.add_gauges("speebgpt_scheduler", "Response scheduler state.",
+                           lambda: scheduler.stats(per_guild=tracer.guild_label), key_label="guild")
+tracer.registry.add_gauges("speebgpt_conversations", "Conversation registry state.", conversation_registry.stats)
+tracer.registry.add_gauges("speebgpt_attachments", "Attachment store state.", attachment_store.stats)
+tracer.registry.add_gauges("speebgpt_moderation_batches", "Moderation batching.",
+                           openai_gateway.moderation_batcher.stats)
+for cache_name, cache in (("weather", weather_gateway.cache), ("brave", brave_search_gateway.cache),
+                          ("genius", genius_gateway.cache), ("fetched_messages", fetched_messages)):
+    tracer.registry.add_gauges("speebgpt_cache", "Cache state.", cache.stats, {"cache": cache_name})
+for upstream, gateway in (("weather", weather_gateway), ("brave", brave_search_gateway), ("genius", genius_gateway)):
+    tracer.registry.add_gauges("speebgpt_http_pool", "HTTP connection pool usage.", gateway.client.stats,
+                               {"upstream": upstream})
+if spotify_prefetcher is not None:
+    tracer.registry.add_gauges("speebgpt_spotify_prefetch", "Spotify track prefetching.", spotify_prefetcher.stats)
+
 
 class ExplicitOutputException(Exception):
     pass
@@ -68,80 +223,102 @@ class ExplicitOutputException(Exception):
 async def run_blocking(blocking_func: typing.Callable, *args, **kwargs) -> typing.Any:
     """Runs a blocking function in a non-blocking way"""
     func = functools.partial(blocking_func, *args, **kwargs) # `run_in_executor` doesn't support kwargs, `functools.partial` does
-    return await client.loop.run_in_executor(None, func)
+    return await asyncio.get_running_loop().run_in_executor(None, func)
+
+
+async def get_message_history(conversation: Conversation, new_messages: list[Message] | None = None) -> list[dict]:
+    # Encodes any attachments the payload needs off the event loop, then builds the payload (followed by
+    # new_messages, which aren't part of the conversation). The attachments are pinned meanwhile, so encoding
+    # some of them (or other payloads' attachments) can't drop the data URLs of the others.
+    new_messages = new_messages if new_messages is not None else []
+    files = conversation.files() + [file for message in new_messages if message.has_files() for file in message.files]
 
+    with attachment_store.pinned(file.digest for file in files):
+        await asyncio.gather(*(attachment_store.encode(file.digest) for file in files))
+        return conversation.to_list_dict() + [message.to_dict() for message in new_messages]
 
-def get_openai_response(conversation: Conversation):
-    message_history = conversation.to_list_dict()
-    return openai_gateway.generate_response(message_history)
 
+async def get_openai_response(conversation: Conversation, reasoning: str | None = None,
+                              instructions: str | None = None) -> str:
+    message_history = await get_message_history(conversation)
+    return await openai_gateway.generate_response(message_history, reasoning=reasoning, instructions=instructions)
 
-def check_for_explicit_content(message: str) -> bool:
-    return openai_gateway.moderation_filter(message)
+
+async def check_for_explicit_content(message: str) -> bool:
+    return await openai_gateway.moderation_filter(message)
 
 
 async def check_for_mention_wakeup(discord_message: discord.Message) -> bool:
-    if len(discord_message.content.split()) > 1:
-        # remove the non-alphanumeric characters, and make all characters lowercase (somehow, this actually works!)
-        check_string = ''.join(char.lower() if char.isalnum() or char == ' ' else '' for char in list(discord_message.content))
-        check_list = check_string.split(' ')
-
-        # first case: greeting is one word long
-        for alias in ALIASES:
-            if alias in check_list[1] and check_list[0] in WAKE_UP:
-                return True
-
-        # second case: greeting is two words long
-        if len(discord_message.content.split()) > 2:
-            for alias in ALIASES:
-                if alias in check_list[2] and (' '.join((check_list[0], check_list[1])) in WAKE_UP or
-                                               check_list[0] == "good" or check_list[0] == "happy"):
-                    return True
+    # first case: greeting followed by an alias (e.g. "hey speeb" or "good morning speebot")
+    matcher = wake_words.for_guild(discord_message.guild.id if discord_message.guild is not None else None)
+    if matcher.matches(discord_message.content):
+        return True
 
     # second case: via mention
     if f"<@{client.user.id}>" in discord_message.content:
         # time to create a new conversation
-        discord_message.content = discord_message.content.replace(f"<@{client.user.id}>", ALIASES[0])
+        discord_message.content = discord_message.content.replace(f"<@{client.user.id}>", matcher.aliases[0])
         return True
 
     # Everything else:
     return False
 
 
-async def check_for_reply_wakeup(discord_message: discord.Message) -> bool:
-    if discord_message.reference is None:
-        return False
+async def resolve_reference(discord_message: discord.Message) -> discord.Message | None:
+    # Resolves the message being replied to (if any) without a REST call whenever possible:
+    # first from the gateway payload, then the client's message cache, and finally from
+    # the messages fetched recently. Should be called once per event, with the result
+    # passed along.
+    reference = discord_message.reference
+    if reference is None:
+        return None
+
+    if isinstance(reference.resolved, discord.Message):
+        return reference.resolved
 
-    get_reference_message = await discord_message.channel.fetch_message(discord_message.reference.message_id)
+    # The referenced message has since been deleted.
+    if isinstance(reference.resolved, discord.DeletedReferencedMessage):
+        return None
+
+    if reference.cached_message is not None:
+        return reference.cached_message
+
+    try:
+        return fetched_messages.get(reference.message_id)
+    except KeyError:
+        pass
 
-    if get_reference_message.author.id == client.user.id:
+    get_reference_message = await discord_message.channel.fetch_message(reference.message_id)
+    fetched_messages.set(reference.message_id, get_reference_message)
+
+    return get_reference_message
+
+
+async def check_for_reply_wakeup(discord_message: discord.Message,
+                                 reference_message: discord.Message | None) -> bool:
+    if reference_message is None:
+        return False
+
+    if reference_message.author.id == client.user.id:
         return True
 
     return False
 
 
 async def get_conversation(discord_message: discord.Message) -> Conversation:
-    global conversations_history
-
-    for conversation in conversations_history:
-        if discord_message.reference.message_id in conversation["message_history"]:
-            return conversation["conversation"]
-
-    raise ValueError("No conversation found")
+    try:
+        return conversation_registry.get(discord_message.reference.message_id)
+    except KeyError:
+        raise ValueError("No conversation found")
 
 
 async def create_conversation(discord_message: discord.Message) -> Conversation:
-    # Creates a conversation object, adds to conversation_history, then
+    # Creates a conversation object, adds it to the conversation registry, then
     # returns the newly created conversation.
 
-    global conversations_history
-
     # Create new conversation
-    new_conversation = Conversation()
-    conversations_history.append({
-        "conversation": new_conversation,
-        "message_history": [discord_message.id],
-    })
+    new_conversation = Conversation(max_tokens=CONVERSATION_MAX_TOKENS)
+    conversation_registry.register(new_conversation, discord_message.id)
 
     return new_conversation
 
@@ -150,19 +327,26 @@ SUPPORTED_IMAGES = ["png", "jpg", "jpeg", "webp", "gif"]
 SUPPORTED_FILES = ["pdf"]
 
 
-async def get_reference_content(discord_message: discord.Message) -> str:
-    if discord_message.reference is None:
-        return ""
+async def create_reference_message(reference_message: discord.Message | None) -> Message | None:
+    # Creates a message out of the message being replied to (if any).
+    if reference_message is None:
+        return None
 
-    get_reference_message = await discord_message.channel.fetch_message(discord_message.reference.message_id)
-    return get_reference_message.content
+    return await create_message(reference_message, "user")
 
 
-async def create_message(discord_message: discord.Message, role: str, has_reference = False) -> Message:
+def store_attachment(filename: str, data: bytes) -> File:
+    # The File is created alongside the put (in the executor), so that the reference put takes is
+    # released when the File is garbage collected, even if the awaiting task was cancelled meanwhile.
+    return File(filename, attachment_store.put(data), attachment_store)
+
+
+async def create_message(discord_message: discord.Message, role: str,
+                         reference_message: discord.Message | None = None) -> Message:
     text_content = discord_message.content
 
     images = []
-    files = []
+    pdf_attachments = []
 
     for attachment in discord_message.attachments:
         if attachment.content_type.startswith("image"):
@@ -171,16 +355,19 @@ async def create_message(discord_message: discord.Message, role: str, has_refere
                     images.append(Image(attachment.url))
                     break
 
-        elif attachment.content_type == "application/pdf":
-            files.append(File(attachment.filename, await attachment.read()))
+        elif attachment.content_type == "application/pdf" and attachment.size <= MAX_ATTACHMENT_BYTES:
+            pdf_attachments.append(attachment)
+
+    # PDFs are downloaded concurrently, then hashed into the attachment store off the event loop.
+    downloads = await asyncio.gather(*(attachment.read() for attachment in pdf_attachments))
+    files = list(await asyncio.gather(*(run_blocking(store_attachment, attachment.filename, data)
+                                        for attachment, data in zip(pdf_attachments, downloads))))
 
-    if not has_reference:
+    if reference_message is None:
         new_message = Message(role, text_content, images, files)
         return new_message
 
-    get_reference_message = await discord_message.channel.fetch_message(discord_message.reference.message_id)
-
-    if get_reference_message.author.id == client.user.id:
+    if reference_message.author.id == client.user.id:
         new_message = Message(role, text_content, images, files)
         return new_message
 
@@ -190,36 +377,202 @@ async def create_message(discord_message: discord.Message, role: str, has_refere
     return new_message
 
 
-async def message_response_pipeline(discord_message: discord.Message,
-                                    message: Message, conversation: Conversation) -> discord.Message:
+def attachment_types(discord_message: discord.Message) -> tuple[bool, bool]:
+    # Whether the message has PDF files, and whether it has images.
+    has_files = any(attachment.content_type == "application/pdf" for attachment in discord_message.attachments)
+    has_images = any((attachment.content_type or "").startswith("image") for attachment in discord_message.attachments)
+
+    return has_files, has_images
+
+
+async def get_route(discord_message: discord.Message, reference_message: typing.Awaitable[Message | None]) -> dict:
+    # Returns a dict with the flag for the message, along with the arguments the flag's
+    # integration needs when they could be extracted in the same call (see GoogleAPIGateway.route).
+
+    # Skips the Gemini round trip when the local classifier is confident enough.
+    has_files, has_images = attachment_types(discord_message)
+
+    flag = intent_classifier.classify(discord_message.content, has_files, has_images)
+    if flag is not None:
+        if routing_log is not None and random.random() < ROUTING_SHADOW_RATE:
+            # Outside of the message's trace, since nothing waits for it.
+            task = asyncio.create_task(shadow_route(discord_message, reference_message, flag, has_files, has_images),
+                                       context=contextvars.Context())
+            shadow_routing_tasks.add(task)
+            task.add_done_callback(shadow_routing_tasks.discard)
+
+        return {"flag": flag}
+
+    start = time.perf_counter()
+    router_input = await get_router_input(discord_message, reference_message)
+    route = await route_with_gemini(router_input)
+
+    if routing_log is not None:
+        await run_blocking(routing_log.record, discord_message.content, route.get("flag", "--none"),
+                           (time.perf_counter() - start) * 1000, has_files, has_images, router_input=router_input)
+
+    return route
+
+
+async def get_router_input(discord_message: discord.Message,
+                           reference_message: typing.Awaitable[Message | None]) -> str:
+    # The text Gemini routes the message on. With combined routing, the extracted arguments depend
+    # on what's being replied to, and what the user is listening to, so those are included.
+    content = discord_message.content
+    if not COMBINED_ROUTING:
+        return content
+
+    reference = await reference_message
+    if reference is not None:
+        content = f"> (replying to): {reference.text_content}\n" + content
+
+    user_info = add_user_information(discord_message)
+    if user_info != "":
+        content = f"(The user is playing: {user_info})\n" + content
+
+    return content
+
+
+async def route_with_gemini(router_input: str) -> dict:
+    if COMBINED_ROUTING:
+        return await google_gateway.route(router_input)
+
+    return {"flag": await google_gateway.get_flags(router_input)}
+
+
+async def shadow_route(discord_message: discord.Message, reference_message: typing.Awaitable[Message | None],
+                       local_flag: str, has_files: bool, has_images: bool) -> None:
+    # Logs Gemini's flag for a message the local classifier routed, alongside the local flag.
+    # Gemini is given the same input it would have been given to route the message itself.
+    start = time.perf_counter()
+    try:
+        router_input = await get_router_input(discord_message, reference_message)
+        route = await route_with_gemini(router_input)
+    except asyncio.CancelledError:
+        # The reference fetch is cancelled along with the message, e.g. if moderation flags it.
+        if asyncio.current_task().cancelling():
+            raise
+        return
+    except Exception:
+        return
+
+    await run_blocking(routing_log.record, discord_message.content, route.get("flag", "--none"),
+                       (time.perf_counter() - start) * 1000, has_files, has_images, local_flag,
+                       ROUTING_SHADOW_RATE, router_input)
+
+
+async def gather_message_context(discord_message: discord.Message, reference_message: discord.Message | None,
+                                 speculation_history: Conversation | None = None) -> dict | None:
+    # Moderation, message creation, flag routing and the reference fetch only depend on
+    # the incoming message, so they are all started at once. If moderation flags the
+    # message (or fails), everything else is cancelled and None is returned.
+    # Given the conversation's history, a general response is started alongside them (see speculate_response).
+    reference_task = asyncio.create_task(tracer.wrap("reference", create_reference_message(reference_message)))
+    tasks = {
+        "message": asyncio.create_task(tracer.wrap("message", create_message(discord_message, "user",
+                                                                             reference_message))),
+        "route": asyncio.create_task(tracer.wrap("route", get_route(discord_message, reference_task))),
+        "reference_message": reference_task,
+    }
+
+    speculation = None
+    if speculation_history is not None:
+        speculation = asyncio.create_task(tracer.wrap("speculation", speculate_response(
+            speculation_history, tasks["message"], reference_task)))
+
+    try:
+        # All explicit content is ignored
+        if await tracer.wrap("moderation", check_for_explicit_content(discord_message.content)):
+            for task in tasks.values():
+                task.cancel()
+            if speculation is not None:
+                discard_speculation(discord_message, speculation_history, speculation, "aborted")
+            return None
+
+        results = await asyncio.gather(*tasks.values())
+
+    except BaseException:
+        for task in tasks.values():
+            task.cancel()
+        if speculation is not None:
+            discard_speculation(discord_message, speculation_history, speculation, "aborted")
+        raise
+
+    return {**dict(zip(tasks.keys(), results)), "speculation": speculation}
+
+
+def should_speculate(discord_message: discord.Message) -> bool:
+    if not SPECULATE_IN_ALL_GUILDS and (discord_message.guild is None
+                                        or discord_message.guild.id not in SPECULATIVE_GUILDS):
+        return False
+
+    # No point speculating if the local classifier already knows the message needs an integration.
+    return intent_classifier.classify(discord_message.content, *attachment_types(discord_message)) in (None, "--none")
+
+
+async def speculate_response(conversation: Conversation, message: typing.Awaitable[Message],
+                             reference_message: typing.Awaitable[Message | None]) -> tuple[str, int]:
+    # Generates a general response (and returns it with the tokens used), as if the message and
+    # the message it replies to had been added to the conversation, without adding them.
+    reference_message, message = await asyncio.gather(reference_message, message)
+    new_messages = [new_message for new_message in (reference_message, message) if new_message is not None]
+    message_history = await get_message_history(conversation, new_messages)
+
+    return await openai_gateway.generate_response_with_usage(message_history)
+
+
+def discard_speculation(discord_message: discord.Message, conversation: Conversation,
+                        speculation: asyncio.Task, result: str = "miss") -> None:
+    # Cancels a speculative response that won't be used, and counts the tokens it used. If it
+    # hadn't finished, the conversation's tokens are counted, as its prompt may have been sent.
+    guild = discord_message.guild.id if discord_message.guild is not None else "dm"
+    speculation_results.inc(guild=guild, result=result)
+
+    if speculation.done() and not speculation.cancelled() and speculation.exception() is None:
+        wasted_tokens = speculation.result()[1]
+    else:
+        speculation.cancel()
+        wasted_tokens = conversation.token_count()
+
+    speculation_wasted_tokens.inc(wasted_tokens, guild=guild)
+
+
+async def message_response_pipeline(discord_message: discord.Message, message: Message,
+                                    conversation: Conversation, route: dict,
+                                    reference_content: str = "",
+                                    speculation: asyncio.Task | None = None) -> discord.Message:
     # First, adds the message to the conversation
     # returns a message in the form of Message, with bot response.
 
     # Add message to conversation
     conversation.add_message(message)
 
-    # Get flags
-    flag = google_gateway.get_flags(message.text_content)
-
     try:
-        match flag:
+        match route.get("flag"):
             case "--web":
-                return await create_search_response(discord_message, message, conversation)
+                return await create_search_response(discord_message, message, conversation, reference_content,
+                                                    route.get("search_term"))
 
             case "--weather":
-                return await create_weather_response(discord_message, message, conversation)
+                locations = [(location["city"], location["country"]) for location in route.get("locations", [])
+                             if location.get("city") and location.get("country")]
+
+                return await create_weather_response(discord_message, message, conversation, reference_content,
+                                                     locations or None)
 
             case "--song":
-                return await create_song_response(discord_message, message, conversation)
+                return await create_song_response(discord_message, message, conversation, reference_content,
+                                                  route.get("song_name"), route.get("song_artists"))
 
             case "--artist":
-                return await create_artist_response(discord_message, message, conversation)
+                return await create_artist_response(discord_message, message, conversation, reference_content,
+                                                    route.get("artist"))
 
             case "--logic":
                 return await create_logical_response(discord_message, conversation)
 
             case _:
-                return await create_general_response(discord_message, conversation)
+                return await create_general_response(discord_message, conversation, speculation)
 
     except ExplicitOutputException:
         raise ExplicitOutputException("Harmful content detected")
@@ -246,24 +599,20 @@ def add_user_information(discord_message: discord.Message) -> str:
     return activity_str
 
 
-def get_history_list(conversation: Conversation) -> list:
-    for past_conversation in conversations_history:
-        if past_conversation["conversation"] == conversation:
-            return past_conversation["message_history"]
-
-    raise ValueError("No conversation found")
-
-
 async def create_search_response(discord_message: discord.Message,
-                                 message: Message, conversation: Conversation) -> discord.Message:
-    reference_text = f"> (replying to): {await get_reference_content(discord_message)}\n"
-
-    seo_optimized = google_gateway.search_engine_optimization(reference_text + message.text_content)
+                                 message: Message, conversation: Conversation, reference_content: str = "",
+                                 search_term: str | None = None) -> discord.Message:
+    if search_term is None:
+        reference_text = f"> (replying to): {reference_content}\n"
+        seo_optimized = await tracer.wrap("extract", google_gateway.search_engine_optimization(
+            reference_text + message.text_content))
+    else:
+        seo_optimized = search_term
 
     # Send web search notification
-    await discord_message.channel.send(f"> 🔍 Searching for: {seo_optimized}")
+    await tracer.wrap("discord_send", discord_message.channel.send(f"> 🔍 Searching for: {seo_optimized}"))
 
-    search_results = brave_search_gateway.concise_search(seo_optimized)
+    search_results = await tracer.wrap("lookup", brave_search_gateway.concise_search(seo_optimized))
 
     summarize_results = ""
     for i in range(len(search_results)):
@@ -273,18 +622,9 @@ async def create_search_response(discord_message: discord.Message,
     system_message = Message("system", f"below are some search results to help answer the user's query:\n{summarize_results}")
     conversation.add_message(system_message)
 
-    response = await run_blocking(get_openai_response, conversation)
-
-    if check_for_explicit_content(response):
-        raise ExplicitOutputException("Harmful content detected")
-
-    async with discord_message.channel.typing():
-        assistant_message = Message("assistant", response)
-    conversation.add_message(assistant_message)
-
     embed = generate_search_embed(seo_optimized, search_results)
 
-    sent_message = await discord_message.reply(response + DISCLAIMER, embed=embed)
+    sent_message = await generate_and_reply(discord_message, conversation, embed)
 
     return sent_message
 
@@ -319,32 +659,55 @@ def weather_summary_string(weather_response: dict) -> str:
 
 
 async def create_weather_response(discord_message: discord.Message,
-                            message: Message, conversation: Conversation) -> discord.Message:
-    reference_text = f"> (replying to): {await get_reference_content(discord_message)}\n"
-    get_location = google_gateway.attain_location_information(reference_text + message.text_content)
-    city, country = get_location.split(', ')
-    weather_results = weather_gateway.weather_lookup(f"{city},{country}")
+                            message: Message, conversation: Conversation, reference_content: str = "",
+                            locations: list[tuple[str, str]] | None = None) -> discord.Message:
+    if locations is None:
+        reference_text = f"> (replying to): {reference_content}\n"
+        locations = await tracer.wrap("extract", google_gateway.attain_location_information(
+            reference_text + message.text_content))
 
-    weather_summary = weather_summary_string(weather_results)
+    weather_results = await tracer.wrap("lookup", lookup_weather(locations))
 
-    system_message = Message("system", f"Below is the weather info for {weather_results['city']} in json format. "
+    weather_summary = "\n".join(f"{weather_response['city']}:" + weather_summary_string(weather_response)
+                                for weather_response in weather_results)
+    cities = ", ".join(weather_response['city'] for weather_response in weather_results)
+
+    system_message = Message("system", f"Below is the weather info for {cities} in json format. "
                                        f"The units are in metric. Use it to answer the user's prompt and help them address their needs. "
                                       f"Round numbers.\n" + weather_summary)
     conversation.add_message(system_message)
 
-    response = await run_blocking(get_openai_response, conversation)
-
-    assistant_message = Message("assistant", response)
-    conversation.add_message(assistant_message)
-
     embed = generate_weather_embed(weather_results)
 
-    sent_message = await discord_message.reply(response + DISCLAIMER, embed=embed)
+    sent_message = await generate_and_reply(discord_message, conversation, embed)
 
     return sent_message
 
 
-def generate_weather_embed(weather_response: dict) -> Embed:
+async def lookup_weather(locations: list[tuple[str, str]]) -> list[dict]:
+    # Looks up every location at once (a few at a time), so comparing locations takes about as long
+    # as looking up one. Locations that can't be looked up are left out, unless none can be.
+    locations = list(dict.fromkeys((city, country) for city, country in locations))[:MAX_WEATHER_LOCATIONS]
+    semaphore = asyncio.Semaphore(WEATHER_LOOKUP_CONCURRENCY)
+
+    async def lookup(city: str, country: str) -> dict:
+        async with semaphore:
+            return await weather_gateway.weather_lookup(f"{city},{country}")
+
+    results = await asyncio.gather(*(lookup(city, country) for city, country in locations), return_exceptions=True)
+
+    weather_results = [result for result in results if not isinstance(result, BaseException)]
+    if not weather_results:
+        raise results[0]
+
+    return weather_results
+
+
+def generate_weather_embed(weather_responses: list[dict]) -> Embed:
+    if len(weather_responses) > 1:
+        return generate_comparison_weather_embed(weather_responses)
+
+    weather_response = weather_responses[0]
     icon_url = f"https://openweathermap.org/img/wn/{weather_response['icon']}@4x.png"
     country = pycountry.countries.get(alpha_2=weather_response['country'])
     embed = Embed(title=f"Weather Forecast in {weather_response['city']}, {country.name}",
@@ -386,35 +749,73 @@ def generate_weather_embed(weather_response: dict) -> Embed:
     return embed
 
 
-async def create_song_response(discord_message: discord.Message,
-                                 message: Message, conversation: Conversation) -> discord.Message:
-    reference_text = f"> (replying to): {await get_reference_content(discord_message)}\n"
-    user_info = add_user_information(discord_message)
-    if user_info == "":
-        song_details = google_gateway.attain_song_information(reference_text + message.text_content)
-    else:
-        song_details = google_gateway.attain_song_information(f"(The user is playing: {user_info})\n" +
-                                                              reference_text + message.text_content)
-    song_name, song_artists = song_details.split('\n')
-    song_artists = song_artists.split(',')
-    for i in range(len(song_artists)):
-        song_artists[i] = song_artists[i].strip("\"")
+def generate_comparison_weather_embed(weather_responses: list[dict]) -> Embed:
+    # One embed for several locations, with a field for each of them.
+    cities = ", ".join(weather_response['city'] for weather_response in weather_responses)
+    embed = Embed(title=f"Weather Forecast in {cities}", url="https://openweathermap.org/",
+                  description="Via openweathermap.org", color=0xfab9ff)
+    embed.set_thumbnail(url=f"https://openweathermap.org/img/wn/{weather_responses[0]['icon']}@4x.png")
+    embed.set_author(name=client.user.name, url=PROJECT_URL, icon_url=client.user.avatar.url)
 
-    song_info = genius_gateway.get_song_info(song_name, song_artists[0])
+    for weather_response in weather_responses:
+        country = pycountry.countries.get(alpha_2=weather_response['country'])
+        weather_description = ' '.join(
+            word.capitalize() for word in weather_response['description'].split(' '))
 
-    system_message = Message("system", f"below is some information to help answer the user's query:\n{
-    song_info['description']}")
+        if weather_response['rain'] != 0:
+            rain_description = f"Raining {weather_response['rain']}mm/h 🌧️"
+        elif weather_response['snow'] != 0:
+            rain_description = f"Snowing {weather_response['snow']}mm/h 🌨️"
+        else:
+            rain_description = "No rain ☀️"
 
-    conversation.add_message(system_message)
+        embed.add_field(name=f"{weather_response['city']}, {country.name if country else weather_response['country']}",
+                        value=f"{weather_description}, currently {round(weather_response['temp'])}°C "
+                              f"(feels like {round(weather_response['feels_like'])}°C).\n"
+                              f"High of {round(weather_response['temp_max'])}°C and low of "
+                              f"{round(weather_response['temp_min'])}°C. {rain_description}\n"
+                              f"Wind of {weather_response['wind_speed']}km/h from the "
+                              f"{weather_response['wind_direction']}.",
+                        inline=True)
 
-    response = await run_blocking(get_openai_response, conversation)
+    embed.set_footer(text="I am a bot, and this action was performed automatically.")
+    embed.timestamp = datetime.now()
 
-    assistant_message = Message("assistant", response)
-    conversation.add_message(assistant_message)
+    return embed
+
+
+async def create_song_response(discord_message: discord.Message,
+                                 message: Message, conversation: Conversation, reference_content: str = "",
+                                 song_name: str | None = None, song_artists: list[str] | None = None) -> discord.Message:
+    # Questions about what the user is listening to are answered from their Spotify activity.
+    activity = spotify_activity(discord_message.author)
+    if activity is not None and activity.artists and refers_to_current_track(message.text_content):
+        song_name, song_artists = activity.title, activity.artists
+
+    elif song_name is None or not song_artists:
+        reference_text = f"> (replying to): {reference_content}\n"
+        user_info = add_user_information(discord_message)
+        if user_info == "":
+            song_details = await tracer.wrap("extract", google_gateway.attain_song_information(
+                reference_text + message.text_content))
+        else:
+            song_details = await tracer.wrap("extract", google_gateway.attain_song_information(
+                f"(The user is playing: {user_info})\n" + reference_text + message.text_content))
+        song_name, song_artists = song_details.split('\n')
+        song_artists = song_artists.split(',')
+        for i in range(len(song_artists)):
+            song_artists[i] = song_artists[i].strip("\"")
+
+    song_info = await tracer.wrap("lookup", genius_gateway.get_song_info(song_name, song_artists[0]))
+
+    system_message = Message("system", f"below is some information to help answer the user's query:\n"
+                                       f"{song_info['description']}")
+
+    conversation.add_message(system_message)
 
     embed = await generate_song_embed(song_info)
 
-    sent_message = await discord_message.reply(response + DISCLAIMER, embed=embed)
+    sent_message = await generate_and_reply(discord_message, conversation, embed)
 
     return sent_message
 
@@ -438,30 +839,32 @@ async def generate_song_embed(song_info: dict) -> Embed:
 
 
 async def create_artist_response(discord_message: discord.Message,
-                                 message: Message, conversation: Conversation) -> discord.Message:
-    reference_text = f"> (replying to): {await get_reference_content(discord_message)}\n"
-    user_info = add_user_information(discord_message)
-    if user_info == "":
-        artist_details = google_gateway.attain_artist_information(reference_text + message.text_content)
-    else:
-        artist_details = google_gateway.attain_artist_information(f"(The user is playing: {user_info})\n" +
-                                                                  reference_text + message.text_content)
+                                 message: Message, conversation: Conversation, reference_content: str = "",
+                                 artist_details: str | None = None) -> discord.Message:
+    activity = spotify_activity(discord_message.author)
+    if activity is not None and activity.artists and refers_to_current_track(message.text_content):
+        artist_details = activity.artists[0]
+
+    elif artist_details is None:
+        reference_text = f"> (replying to): {reference_content}\n"
+        user_info = add_user_information(discord_message)
+        if user_info == "":
+            artist_details = await tracer.wrap("extract", google_gateway.attain_artist_information(
+                reference_text + message.text_content))
+        else:
+            artist_details = await tracer.wrap("extract", google_gateway.attain_artist_information(
+                f"(The user is playing: {user_info})\n" + reference_text + message.text_content))
 
-    artist_info = genius_gateway.get_artist_info(artist_details)
+    artist_info = await tracer.wrap("lookup", genius_gateway.get_artist_info(artist_details))
 
-    system_message = Message("system", f"below is some information to help answer the user's query:\n{
-    artist_info['description']}")
+    system_message = Message("system", f"below is some information to help answer the user's query:\n"
+                                       f"{artist_info['description']}")
 
     conversation.add_message(system_message)
 
-    response = await run_blocking(get_openai_response, conversation)
-
-    assistant_message = Message("assistant", response)
-    conversation.add_message(assistant_message)
-
     embed = await generate_artist_embed(artist_info)
 
-    sent_message = await discord_message.reply(response + DISCLAIMER, embed=embed)
+    sent_message = await generate_and_reply(discord_message, conversation, embed)
 
     return sent_message
 
@@ -489,53 +892,116 @@ async def generate_artist_embed(artist_info: dict) -> Embed:
 
 async def create_logical_response(discord_message: discord.Message, conversation: Conversation) -> discord.Message:
     # Send model change notification
-    await discord_message.channel.send(f"> 💭 Switching to high reasoning model...")
-
-    # Change instructions to allow for longer response
-    longer_instructions = """
-    You are a helpful assistant named Speebot.
-    Give sassy and concise, but helpful responses. (Try and limit yourself to under 500 words.)
-    Use the instructions given by the system to help form responses.
-    """
-    conversation.change_instructions(longer_instructions)
+    await tracer.wrap("discord_send", discord_message.channel.send(f"> 💭 Switching to high reasoning model..."))
+
+    # Longer instructions and high reasoning are only used for this response, so
+    # neither the conversation nor the gateway is modified.
+    return await generate_and_reply(discord_message, conversation,
+                                    reasoning="high", instructions=LOGICAL_INSTRUCTIONS)
+
+
+async def create_general_response(discord_message: discord.Message, conversation: Conversation,
+                                  speculation: asyncio.Task | None = None) -> discord.Message:
+    return await generate_and_reply(discord_message, conversation, speculation=speculation)
+
+
+async def generate_and_reply(discord_message: discord.Message, conversation: Conversation,
+                             embed: Embed | None = None, reasoning: str | None = None,
+                             instructions: str | None = None,
+                             speculation: asyncio.Task | None = None) -> discord.Message:
+    # Generates the assistant's response to the conversation, replies with it,
+    # and adds it to the conversation. Raises ExplicitOutputException if the
+    # response is flagged by moderation. `reasoning` and `instructions` override
+    # the gateway's reasoning effort and the conversation's instructions for this response.
+    # If given, the response from `speculation` is used instead (and isn't streamed).
+    response = None
+    if speculation is not None:
+        guild = discord_message.guild.id if discord_message.guild is not None else "dm"
+        try:
+            response, _ = await tracer.wrap("completion", speculation)
+            speculation_results.inc(guild=guild, result="hit")
+        except Exception:
+            speculation_results.inc(guild=guild, result="failed")
 
-    # change to high reasoning
-    openai_gateway.change_reasoning("high")
-    response = await run_blocking(get_openai_response, conversation)
-    openai_gateway.change_reasoning("low")
+    if response is None and STREAM_RESPONSES:
+        sent_message, response = await stream_reply(discord_message, conversation, embed, reasoning, instructions)
 
-    # Return instructions to the original
-    original_instructions = """
-    You are a helpful assistant named Speebot. Give sassy and concise, but helpful responses 
-    (Try and limit yourself to at most around 2 to 3 sentences). Use the instructions given by the system to help form responses.
-    """
-    conversation.change_instructions(original_instructions)
+    else:
+        if response is None:
+            response = await tracer.wrap("completion", get_openai_response(conversation, reasoning, instructions))
 
-    if check_for_explicit_content(response):
-        raise ExplicitOutputException("Harmful content detected")
+        if await tracer.wrap("output_moderation", check_for_explicit_content(response)):
+            raise ExplicitOutputException("Harmful content detected")
 
-    async with discord_message.channel.typing():
-        assistant_message = Message("assistant", response)
+        sent_message = await tracer.wrap("discord_send", discord_message.reply(response + DISCLAIMER, embed=embed))
 
+    assistant_message = Message("assistant", response)
     conversation.add_message(assistant_message)
 
-    sent_message = await discord_message.reply(response + DISCLAIMER)
-
     return sent_message
 
 
-async def create_general_response(discord_message: discord.Message, conversation: Conversation) -> discord.Message:
-    response = get_openai_response(conversation)
+async def stream_reply(discord_message: discord.Message, conversation: Conversation,
+                       embed: Embed | None = None, reasoning: str | None = None,
+                       instructions: str | None = None) -> tuple[discord.Message, str]:
+    # Posts a placeholder reply, then edits it as the response streams in (at most once
+    # every STREAM_EDIT_INTERVAL seconds). Text is only shown once it has passed
+    # moderation, which runs on the accumulated text every STREAM_MODERATION_CHUNK
+    # characters, alongside the stream. Returns the sent message and the full response.
+    placeholder = await tracer.wrap("discord_send", discord_message.reply("> 💭 Thinking..."))
 
-    if check_for_explicit_content(response):
-        raise ExplicitOutputException("Harmful content detected")
+    response = ""
+    visible_length = 0
+    edited_length = 0
+    last_edit = time.monotonic()
 
-    assistant_message = Message("assistant", response)
-    conversation.add_message(assistant_message)
+    moderation_task: asyncio.Task | None = None
+    moderation_length = 0
 
-    sent_message = await discord_message.reply(response + DISCLAIMER)
+    try:
+        with tracer.span("completion"):
+            completion_start = time.perf_counter()
+            message_history = await get_message_history(conversation)
+            async for delta in openai_gateway.stream_response(message_history, reasoning=reasoning,
+                                                              instructions=instructions):
+                if not response:
+                    tracer.record("first_token", completion_start, time.perf_counter() - completion_start)
 
-    return sent_message
+                response += delta
+
+                if moderation_task is not None and moderation_task.done():
+                    if moderation_task.result():
+                        raise ExplicitOutputException("Harmful content detected")
+
+                    visible_length = moderation_length
+                    moderation_task = None
+
+                if moderation_task is None and len(response) - visible_length >= STREAM_MODERATION_CHUNK:
+                    moderation_length = len(response)
+                    moderation_task = asyncio.create_task(check_for_explicit_content(response))
+
+                if visible_length > edited_length and time.monotonic() - last_edit >= STREAM_EDIT_INTERVAL:
+                    await tracer.wrap("discord_send", placeholder.edit(content=response[:visible_length] + " ▌"))
+                    edited_length = visible_length
+                    last_edit = time.monotonic()
+
+        if moderation_task is not None:
+            moderation_task.cancel()
+
+        # The full response is always moderated before it's shown.
+        if await tracer.wrap("output_moderation", check_for_explicit_content(response)):
+            raise ExplicitOutputException("Harmful content detected")
+
+        await tracer.wrap("discord_send", placeholder.edit(content=response + DISCLAIMER, embed=embed))
+
+    except BaseException:
+        if moderation_task is not None:
+            moderation_task.cancel()
+
+        await placeholder.delete()
+        raise
+
+    return placeholder, response
 
 
 # If message sent by the femboy
@@ -545,10 +1011,69 @@ async def im_trolling(discord_message: discord.Message):
     await sent_msg.delete()
 
 
+async def respond_to_message(discord_message: discord.Message,
+                             reference_message: discord.Message | None, is_reply: bool) -> None:
+    trace = tracer.current()
+
+    # Speculation needs the conversation's history before moderation. For new conversations, an
+    # empty (unregistered) conversation stands in, so nothing is created for flagged messages.
+    speculation_history = None
+    if should_speculate(discord_message):
+        try:
+            speculation_history = await get_conversation(discord_message) if is_reply else None
+        except ValueError:
+            pass
+
+        if speculation_history is None:
+            speculation_history = Conversation(max_tokens=CONVERSATION_MAX_TOKENS)
+
+    message_context = await gather_message_context(discord_message, reference_message, speculation_history)
+    if message_context is None:
+        trace.outcome = "explicit_input"
+        return
+
+    if is_reply:
+        try:
+            conversation = await get_conversation(discord_message)
+        except ValueError:
+            conversation = await create_conversation(discord_message)
+
+    else:
+        conversation = await create_conversation(discord_message)
+
+    # At this point either we have received a conversation, or one has been created.
+
+    # Anything that isn't exactly one of the flags is handled as --none by the pipeline.
+    flag = message_context["route"].get("flag")
+    trace.labels["route"] = flag if flag in FLAGS else "--none"
+
+    # The speculative response is only used for --none; other routes add to the conversation first.
+    speculation = message_context["speculation"]
+    if speculation is not None and trace.labels["route"] != "--none":
+        discard_speculation(discord_message, conversation, speculation)
+        speculation = None
+
+    async with discord_message.channel.typing():
+        try:
+            reference_content = ""
+            if message_context["reference_message"] is not None:
+                conversation.add_message(message_context["reference_message"])
+                reference_content = message_context["reference_message"].text_content
+
+            sent_message = await message_response_pipeline(discord_message, message_context["message"],
+                                                           conversation, message_context["route"],
+                                                           reference_content, speculation)
+
+        except ExplicitOutputException:
+            trace.outcome = "explicit_output"
+            await discord_message.reply("> Response removed due to explicit or harmful content." + DISCLAIMER)
+            return
+
+    conversation_registry.link(conversation, sent_message.id)
+
+
 @client.event
 async def on_message(discord_message: discord.Message):
-    global conversations_history
-
     # We do a wee bit of trolling.
     if discord_message.author.id == 1074576263936749618:
         if random.randint(0, 100) == 67:
@@ -558,49 +1083,53 @@ async def on_message(discord_message: discord.Message):
     if discord_message.author == client.user:
         return
 
-    if await check_for_reply_wakeup(discord_message):
-        # All explicit content is ignored
-        if check_for_explicit_content(discord_message.content):
-            return
-        try:
-            conversation = await get_conversation(discord_message)
-        except ValueError:
-            conversation = await create_conversation(discord_message)
+    # The message being replied to is resolved once here, and passed through the pipeline.
+    reference_message = await resolve_reference(discord_message)
 
-    elif await check_for_mention_wakeup(discord_message):
-        # All explicit content is ignored
-        if check_for_explicit_content(discord_message.content):
-            return
+    if await check_for_reply_wakeup(discord_message, reference_message):
+        is_reply = True
 
-        conversation = await create_conversation(discord_message)
+    elif await check_for_mention_wakeup(discord_message):
+        is_reply = False
 
     else:
         return
 
-    # At this point either we have received a conversation, or one has been created.
-    async with discord_message.channel.typing():
+    if spotify_prefetcher is not None:
+        spotify_prefetcher.mark_active(discord_message.author.id)
+
+    # Replies to existing conversations are scheduled ahead of new wake-ups.
+    guild_id = discord_message.guild.id if discord_message.guild is not None else None
+    with tracer.request(discord_message.id, guild=guild_id if guild_id is not None else "dm") as trace:
+        queued_at = time.perf_counter()
         try:
-            if discord_message.reference is not None:
-                referenced_discord_message = await discord_message.channel.fetch_message(discord_message.reference.message_id)
-                conversation.add_message(await create_message(referenced_discord_message, "user", False))
-                new_message = await create_message(discord_message, "user", True)
-                sent_message = await message_response_pipeline(discord_message, new_message, conversation)
+            async with scheduler.slot(guild_id, discord_message.author.id, 0 if is_reply else 1):
+                tracer.record("queue", queued_at, time.perf_counter() - queued_at)
+                await respond_to_message(discord_message, reference_message, is_reply)
 
-            else:
-                new_message = await create_message(discord_message, "user", False)
-                sent_message = await message_response_pipeline(discord_message, new_message, conversation)
+        except SchedulerOverloaded:
+            trace.outcome = "shed"
+            if SHED_RESPONSE:
+                await discord_message.reply(SHED_RESPONSE)
+
+
+@client.event
+async def on_presence_update(before: discord.Member, after: discord.Member):
+    if spotify_prefetcher is not None:
+        spotify_prefetcher.on_presence_update(after)
 
-        except ExplicitOutputException:
-            await discord_message.reply("> Response removed due to explicit or harmful content." + DISCLAIMER)
-            return
 
-    message_history_list = get_history_list(conversation)
-    message_history_list.append(sent_message.id)
+@client.event
+async def setup_hook():
+    if metrics_server is not None:
+        await metrics_server.start()
 
 
 @client.event
 async def on_ready():
-    await tree.sync()
+    # Commands are global, so only one worker needs to sync them.
+    if SHARD_IDS is None or 0 in SHARD_IDS:
+        await tree.sync()
     print("Bot is ready.\n-----")
 
     game = discord.CustomActivity("Ready to chat 💭")
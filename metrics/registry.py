@@ -0,0 +1,165 @@
+from __future__ import annotations
+
+import math
+import typing
+
+# Upper bounds (in seconds) of the histogram buckets, suited to upstream API calls.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value: typing.Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: dict[str, typing.Any]) -> str:
+    if not labels:
+        return ""
+
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+class Histogram:
+    """Cumulative histogram of observed values, per combination of label values."""
+
+    def __init__(self, name: str, documentation: str, label_names: tuple[str, ...],
+                 buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.buckets = tuple(sorted(buckets))
+
+        # label values -> (count per bucket, sum, count)
+        self._series: dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels: typing.Any) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[0][index] += 1
+                break
+
+        series[1] += value
+        series[2] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+
+        for key, (bucket_counts, total, count) in sorted(self._series.items()):
+            labels = dict(zip(self.label_names, key))
+
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_format_labels({**labels, 'le': bound})} {cumulative}")
+
+            lines.append(f"{self.name}_bucket{_format_labels({**labels, 'le': '+Inf'})} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {count}")
+
+        return lines
+
+
+class Counter:
+    """Monotonically increasing count, per combination of label values."""
+
+    def __init__(self, name: str, documentation: str, label_names: tuple[str, ...]) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+
+        self._series: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels: typing.Any) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        self._series[key] = self._series.get(key, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self._series.items()):
+            lines.append(f"{self.name}{_format_labels(dict(zip(self.label_names, key)))} {value}")
+
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Holds the bot's metrics, and renders them in the Prometheus text exposition format.
+
+    Besides histograms and counters, stats() dicts of long-lived components (the
+    scheduler, caches, connection pools, ...) can be exposed as gauges with
+    add_gauges, which reads them each time the metrics are rendered. Several
+    components of the same kind can share gauges, told apart by their labels.
+    """
+
+    def __init__(self) -> None:
+        self._histograms: dict[str, Histogram] = {}
+        self._counters: dict[str, Counter] = {}
+        # (prefix, documentation, stats, labels, key label)
+        self._gauges: list[tuple[str, str, typing.Callable[[], dict[str, typing.Any]], dict[str, typing.Any], str]] = []
+
+    def histogram(self, name: str, documentation: str, label_names: tuple[str, ...],
+                  buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        """Returns the histogram with the given name, creating it if it doesn't exist yet."""
+        histogram = self._histograms.get(name)
+        if histogram is None:
+            histogram = self._histograms[name] = Histogram(name, documentation, label_names, buckets)
+
+        return histogram
+
+    def counter(self, name: str, documentation: str, label_names: tuple[str, ...]) -> Counter:
+        """Returns the counter with the given name, creating it if it doesn't exist yet."""
+        counter = self._counters.get(name)
+        if counter is None:
+            counter = self._counters[name] = Counter(name, documentation, label_names)
+
+        return counter
+
+    def add_gauges(self, prefix: str, documentation: str, stats: typing.Callable[[], dict[str, typing.Any]],
+                   labels: dict[str, typing.Any] | None = None, key_label: str = "key") -> None:
+        """
+        Exposes every numeric value of stats() as a gauge named `{prefix}_{key}`, with the given labels.
+        Values that are dicts of numbers (e.g. per-guild breakdowns) become one gauge per entry,
+        labelled with the entry's key as `key_label`.
+        """
+        self._gauges.append((prefix, documentation, stats, labels if labels is not None else {}, key_label))
+
+    def render(self) -> str:
+        lines = []
+        for histogram in self._histograms.values():
+            lines.extend(histogram.render())
+
+        for counter in self._counters.values():
+            lines.extend(counter.render())
+
+        # gauge name -> (documentation, samples), so gauges shared by several components stay together.
+        gauges: dict[str, tuple[str, list[str]]] = {}
+        for prefix, documentation, stats, labels, key_label in self._gauges:
+            for key, value in stats().items():
+                name = f"{prefix}_{key}"
+
+                if isinstance(value, dict):
+                    samples = [({**labels, key_label: "none" if entry is None else entry}, entry_value)
+                               for entry, entry_value in value.items()]
+                else:
+                    samples = [(labels, value)]
+
+                for sample_labels, sample_value in samples:
+                    # Non-numeric values are left out.
+                    if not isinstance(sample_value, (int, float)) or math.isnan(sample_value):
+                        continue
+
+                    if isinstance(sample_value, bool):
+                        sample_value = int(sample_value)
+
+                    gauges.setdefault(name, (documentation, []))[1].append(
+                        f"{name}{_format_labels(sample_labels)} {sample_value}")
+
+        for name, (documentation, samples) in gauges.items():
+            lines.extend([f"# HELP {name} {documentation}", f"# TYPE {name} gauge"])
+            lines.extend(samples)
+
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,61 @@
+from __future__ import annotations
+
+import asyncio
+import inspect
+import typing
+
+from metrics.registry import MetricsRegistry
+
+
+class MetricsServer:
+    """
+    Serves the registry's metrics at GET /metrics, in the Prometheus text format.
+    Meant to be bound to localhost (or a private interface) and scraped by a
+    local Prometheus agent.
+
+    Anything with a render() method can be served in place of a MetricsRegistry,
+    and render() may be a coroutine (e.g. to collect metrics from other processes).
+    """
+
+    def __init__(self, registry: MetricsRegistry | typing.Any, host: str = "127.0.0.1", port: int = 9464) -> None:
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._server: asyncio.Server | None = None
+
+    async def start(self) -> None:
+        if self._server is None:
+            self._server = await asyncio.start_server(self._serve, self.host, self.port)
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            request_line = await reader.readline()
+            # The request headers aren't needed.
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+
+            parts = request_line.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+                status, content_type = "200 OK", "text/plain; version=0.0.4; charset=utf-8"
+                body = self.registry.render()
+                if inspect.isawaitable(body):
+                    body = await body
+                body = body.encode()
+            else:
+                status, content_type, body = "404 Not Found", "text/plain; charset=utf-8", b"Not found\n"
+
+            writer.write(f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\nContent-Length: {len(body)}\r\n"
+                         f"Connection: close\r\n\r\n".encode() + body)
+            await writer.drain()
+
+        except ConnectionError:
+            pass
+
+        finally:
+            writer.close()
@@ -0,0 +1,210 @@
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import contextvars
+import functools
+import inspect
+import json
+import threading
+import time
+import typing
+
+from metrics.registry import MetricsRegistry
+
+
+class Span:
+    """A timed stage of a request, or a gateway call."""
+
+    __slots__ = ("name", "kind", "start", "duration", "outcome")
+
+    def __init__(self, name: str, kind: str, start: float, duration: float, outcome: str) -> None:
+        self.name = name
+        self.kind = kind
+        self.start = start
+        self.duration = duration
+        self.outcome = outcome
+
+
+class RequestTrace:
+    """
+    The spans recorded while handling one Discord message. `labels` (guild and route)
+    and `outcome` can be updated while the request is handled; spans are only added
+    to the histograms once the request finishes, so they all get its final labels.
+    """
+
+    def __init__(self, request_id: typing.Any, labels: dict[str, typing.Any]) -> None:
+        self.request_id = request_id
+        self.labels = labels
+        self.outcome = "ok"
+        self.start = time.perf_counter()
+        self.spans: list[Span] = []
+
+    def to_dict(self, duration: float) -> dict[str, typing.Any]:
+        return {
+            "request_id": self.request_id,
+            **self.labels,
+            "outcome": self.outcome,
+            "duration_ms": duration * 1000,
+            "time": time.time(),
+            "spans": [{"name": span.name, "kind": span.kind, "start_ms": (span.start - self.start) * 1000,
+                       "duration_ms": span.duration * 1000, "outcome": span.outcome} for span in self.spans],
+        }
+
+
+class TraceLog:
+    """
+    Appends one JSON line per request to a file, with its labels, outcome and
+    every span recorded while handling it (relative to the start of the request).
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, "a", encoding="utf-8", buffering=1)
+
+    def record(self, entry: dict[str, typing.Any]) -> None:
+        with self._lock:
+            self._file.write(json.dumps(entry) + "\n")
+
+    def close(self) -> None:
+        self._file.close()
+
+
+_current_trace: contextvars.ContextVar[RequestTrace | None] = contextvars.ContextVar("current_trace", default=None)
+
+
+def _outcome(exception: BaseException) -> str:
+    # Async generators that aren't iterated to the end are closed with GeneratorExit.
+    if isinstance(exception, (asyncio.CancelledError, GeneratorExit)):
+        return "cancelled"
+
+    return "error"
+
+
+class Tracer:
+    """
+    Times requests and their stages, and records them as histograms (tagged by
+    route, guild and outcome) in `registry`, and optionally in `trace_log`.
+
+    The current request is tracked with a context variable, so spans recorded in
+    tasks started while handling a request (and in the gateways) are attributed to it.
+
+    With many guilds, set `guild_label` to False to leave the guild out of the
+    histograms (it's still included in the trace log).
+    """
+
+    LABELS = ("route", "guild")
+
+    def __init__(self, registry: MetricsRegistry | None = None, trace_log: TraceLog | None = None,
+                 guild_label: bool = True) -> None:
+        self.registry = registry if registry is not None else MetricsRegistry()
+        self.trace_log = trace_log
+        self.guild_label = guild_label
+
+        self._requests = self.registry.histogram(
+            "speebgpt_request_duration_seconds", "Time taken to handle a message, end to end.",
+            ("route", "guild", "outcome"))
+        self._stages = self.registry.histogram(
+            "speebgpt_stage_duration_seconds", "Time taken by each stage of handling a message.",
+            ("stage", "route", "guild", "outcome"))
+        self._gateway_calls = self.registry.histogram(
+            "speebgpt_gateway_call_duration_seconds", "Time taken by each gateway method.",
+            ("method", "route", "guild", "outcome"))
+
+    @staticmethod
+    def current() -> RequestTrace | None:
+        return _current_trace.get()
+
+    @contextlib.contextmanager
+    def request(self, request_id: typing.Any, **labels: typing.Any) -> typing.Iterator[RequestTrace]:
+        """Starts tracing a request. Set `route` in the trace's labels once it's known,
+        and its `outcome` if it isn't handled normally."""
+        trace = RequestTrace(request_id, {"guild": "", "route": "", **labels})
+        token = _current_trace.set(trace)
+
+        try:
+            yield trace
+        except BaseException as e:
+            trace.outcome = _outcome(e)
+            raise
+        finally:
+            _current_trace.reset(token)
+            self._finish(trace, time.perf_counter() - trace.start)
+
+    @contextlib.contextmanager
+    def span(self, name: str, kind: str = "stage") -> typing.Iterator[None]:
+        """Times the block, as a stage of the current request (if any)."""
+        start = time.perf_counter()
+        outcome = "ok"
+
+        try:
+            yield
+        except BaseException as e:
+            outcome = _outcome(e)
+            raise
+        finally:
+            self.record(name, start, time.perf_counter() - start, outcome, kind)
+
+    async def wrap(self, name: str, awaitable: typing.Awaitable) -> typing.Any:
+        """Awaits `awaitable`, timing it as a stage of the current request."""
+        with self.span(name):
+            return await awaitable
+
+    def record(self, name: str, start: float, duration: float, outcome: str = "ok", kind: str = "stage") -> None:
+        """Records an already measured span (e.g. the time to the first streamed token)."""
+        span = Span(name, kind, start, duration, outcome)
+
+        trace = _current_trace.get()
+        if trace is None:
+            self._observe(span, {"route": "", "guild": ""})
+        else:
+            trace.spans.append(span)
+
+    def timed(self, name: str) -> typing.Callable:
+        """Decorator timing every call of a gateway method (a coroutine function or
+        an async generator function), as a span of kind "gateway"."""
+
+        def decorator(function: typing.Callable) -> typing.Callable:
+            if inspect.isasyncgenfunction(function):
+                @functools.wraps(function)
+                async def generator_wrapper(*args, **kwargs):
+                    with self.span(name, kind="gateway"):
+                        async for item in function(*args, **kwargs):
+                            yield item
+
+                return generator_wrapper
+
+            @functools.wraps(function)
+            async def wrapper(*args, **kwargs):
+                with self.span(name, kind="gateway"):
+                    return await function(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    # helper functions
+
+    def _observe(self, span: Span, labels: dict[str, typing.Any]) -> None:
+        if span.kind == "gateway":
+            self._gateway_calls.observe(span.duration, method=span.name, outcome=span.outcome, **labels)
+        else:
+            self._stages.observe(span.duration, stage=span.name, outcome=span.outcome, **labels)
+
+    def _finish(self, trace: RequestTrace, duration: float) -> None:
+        labels = {name: trace.labels.get(name, "") for name in Tracer.LABELS}
+        if not self.guild_label:
+            labels["guild"] = ""
+
+        for span in trace.spans:
+            self._observe(span, labels)
+
+        self._requests.observe(duration, outcome=trace.outcome, **labels)
+
+        if self.trace_log is not None:
+            self.trace_log.record(trace.to_dict(duration))
+
+
+# Shared by main.py and the gateways.
+tracer = Tracer()
@@ -0,0 +1,104 @@
+"""
+Evaluates IntentClassifier against logged Gemini routing decisions (see RoutingLog),
+reporting how often the local fast path agrees with Gemini and how much latency it saves.
+
+Fast path messages only reach the logs through shadow routing (see ROUTING_SHADOW_RATE),
+so each shadow decision is weighted by the inverse of its sample rate.
+
+Usage:
+    python -m routing.evaluate_intent_classifier routing_log.jsonl --model intent_model.json
+"""
+from __future__ import annotations
+
+import argparse
+import time
+from collections import Counter
+
+from routing.intent_classifier import IntentClassifier
+from routing.intent_classifier import RoutingLog
+
+
+def evaluate(classifier: IntentClassifier, entries: list[dict]) -> dict:
+    confident = 0.0
+    confident_correct = 0.0
+    correct = 0.0
+    saved_ms = 0.0
+    local_ms = 0.0
+    confusion = Counter()
+    shadowed = 0
+    shadow_agreed = 0
+
+    for entry in entries:
+        start = time.perf_counter()
+        flag, confidence = classifier.predict(entry["content"], entry.get("has_files", False),
+                                              entry.get("has_images", False))
+        local_ms += (time.perf_counter() - start) * 1000
+
+        expected = entry["flag"]
+        weight = 1.0 / entry["sample_rate"] if entry.get("sample_rate") else 1.0
+        correct += weight * (flag == expected)
+
+        if "local_flag" in entry:
+            shadowed += 1
+            shadow_agreed += entry["local_flag"] == expected
+
+        if confidence >= classifier.threshold:
+            confident += weight
+            confident_correct += weight * (flag == expected)
+            saved_ms += weight * entry.get("latency_ms", 0.0)
+            if flag != expected:
+                confusion[(expected, flag)] += 1
+
+    total = sum(1.0 / entry["sample_rate"] if entry.get("sample_rate") else 1.0 for entry in entries)
+
+    return {
+        "decisions": total,
+        "accuracy": correct / total if total else 0.0,
+        "fast_path_coverage": confident / total if total else 0.0,
+        "fast_path_accuracy": confident_correct / confident if confident else 0.0,
+        "gemini_ms_saved": saved_ms,
+        "gemini_ms_saved_per_message": saved_ms / total if total else 0.0,
+        "local_ms_per_message": local_ms / len(entries) if entries else 0.0,
+        "shadow_decisions": shadowed,
+        "shadow_agreement": shadow_agreed / shadowed if shadowed else 0.0,
+        "fast_path_mistakes": confusion,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Evaluate the local intent classifier against Gemini.")
+    parser.add_argument("logs", nargs="+", help="routing log files (JSON lines)")
+    parser.add_argument("--model", default=None, help="trained model (rules only if omitted)")
+    parser.add_argument("--threshold", type=float, default=None)
+    args = parser.parse_args()
+
+    if args.model is None:
+        classifier = IntentClassifier(threshold=args.threshold)
+    else:
+        classifier = IntentClassifier.load(args.model, args.threshold)
+
+    entries = []
+    for path in args.logs:
+        entries.extend(RoutingLog.read(path))
+
+    report = evaluate(classifier, entries)
+
+    print(f"Routing decisions:           {report['decisions']:.0f}")
+    print(f"Threshold:                   {classifier.threshold}")
+    print(f"Agreement with Gemini:       {report['accuracy']:.1%}")
+    print(f"Fast path coverage:          {report['fast_path_coverage']:.1%}")
+    print(f"Fast path agreement:         {report['fast_path_accuracy']:.1%}")
+    print(f"Shadowed live fast path:     {report['shadow_decisions']} decisions, "
+          f"{report['shadow_agreement']:.1%} agreement")
+    print(f"Local latency per message:   {report['local_ms_per_message']:.3f} ms")
+    print(f"Gemini latency saved:        {report['gemini_ms_saved'] / 1000:.1f} s total, "
+          f"{report['gemini_ms_saved_per_message']:.1f} ms per message")
+
+    if report["fast_path_mistakes"]:
+        print("Fast path mistakes (gemini -> local):")
+        for (expected, predicted), count in report["fast_path_mistakes"].most_common():
+            print(f"    {expected} -> {predicted}: {count}")
+
+
+if __name__ == "__main__":
+    main()
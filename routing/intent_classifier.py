@@ -0,0 +1,241 @@
+from __future__ import annotations
+
+import json
+import math
+import os
+import random
+import re
+import time
+import zlib
+
+# Flags understood by message_response_pipeline (see GoogleAPIGateway.flags)
+FLAGS = ["--song", "--artist", "--weather", "--web", "--logic", "--none"]
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9']+")
+
+
+class IntentClassifier:
+    """
+    Local, zero-latency stand-in for GoogleAPIGateway.get_flags.
+
+    Obvious cases are handled by keyword/regex rules mirroring the descriptions
+    in GoogleAPIGateway.flags. Everything else goes through a small linear
+    (softmax) model over hashed unigram and bigram features, which is trained
+    offline from logged Gemini routing decisions (see train_intent_classifier.py).
+
+    Predictions come with a confidence score; callers should only skip the
+    Gemini call when the confidence is at least `threshold`.
+
+    Only the unambiguous rules are confident enough to skip Gemini by default;
+    the others just break ties for the model. Rule confidences can be
+    calibrated against logged Gemini decisions (see calibrate_rules).
+    """
+
+    # (pattern, flag, default confidence), checked in order
+    _RULES: list[tuple[re.Pattern, str, float]] = [
+        (re.compile(r"```"), "--logic", 0.9),
+        (re.compile(r"\b(derivative of|integral of|solve for|solve the equation|simplify the expression|"
+                    r"debug (this|my)|compile (error|this))\b", re.IGNORECASE), "--logic", 0.9),
+        (re.compile(r"\d+\s*[+*/^]\s*\d+\s*=\s*(\?|[a-z]\b)", re.IGNORECASE), "--logic", 0.9),
+        (re.compile(r"\b(equation|calculate|prove|algorithm)\b", re.IGNORECASE), "--logic", 0.5),
+        (re.compile(r"\b(weather|forecast|humidity)\b", re.IGNORECASE), "--weather", 0.95),
+        (re.compile(r"\b(raining|snowing)\b", re.IGNORECASE), "--weather", 0.5),
+        (re.compile(r"\b(this song|what song|which song|song am i|song i'?m|currently listening|"
+                    r"listening to right now)\b", re.IGNORECASE), "--song", 0.9),
+        (re.compile(r"\blyrics\b", re.IGNORECASE), "--song", 0.5),
+        (re.compile(r"\b(who sang|who sings|who made this song)\b", re.IGNORECASE), "--artist", 0.9),
+        (re.compile(r"\bwho produced\b", re.IGNORECASE), "--artist", 0.5),
+    ]
+
+    _FEATURE_BUCKETS = 2 ** 18
+
+    threshold: float
+
+    def __init__(self, weights: dict[str, dict[int, float]] | None = None,
+                 bias: dict[str, float] | None = None, threshold: float | None = None,
+                 rule_confidences: dict[int, float] | None = None) -> None:
+        if threshold is None:
+            threshold = float(os.getenv("INTENT_CONFIDENCE_THRESHOLD", 0.85))
+
+        self.threshold = threshold
+        self._weights = weights if weights is not None else {}
+        self._bias = bias if bias is not None else {}
+        # rule index -> calibrated confidence, overriding the rule's default confidence
+        self._rule_confidences = rule_confidences if rule_confidences is not None else {}
+
+    @property
+    def trained(self) -> bool:
+        return len(self._weights) > 0
+
+    @classmethod
+    def load(cls, path: str, threshold: float | None = None) -> IntentClassifier:
+        with open(path, "r", encoding="utf-8") as model_file:
+            model = json.load(model_file)
+
+        weights = {flag: {int(index): weight for index, weight in flag_weights.items()}
+                   for flag, flag_weights in model["weights"].items()}
+
+        rule_confidences = {int(index): confidence
+                            for index, confidence in model.get("rule_confidences", {}).items()}
+
+        return cls(weights, model["bias"], threshold, rule_confidences)
+
+    def save(self, path: str) -> None:
+        with open(path, "w", encoding="utf-8") as model_file:
+            json.dump({"weights": self._weights, "bias": self._bias,
+                       "rule_confidences": self._rule_confidences}, model_file)
+
+    @staticmethod
+    def features(content: str, has_files: bool = False, has_images: bool = False) -> list[int]:
+        tokens = _TOKEN_PATTERN.findall(content.lower())
+        grams = tokens + [f"{first} {second}" for first, second in zip(tokens, tokens[1:])]
+
+        if has_files:
+            grams.append("__has_files__")
+        if has_images:
+            grams.append("__has_images__")
+
+        return [zlib.crc32(gram.encode()) % IntentClassifier._FEATURE_BUCKETS for gram in grams]
+
+    def predict(self, content: str, has_files: bool = False, has_images: bool = False) -> tuple[str, float]:
+        """Returns the most likely flag and its confidence (between 0 and 1)."""
+
+        # Messages with attachments always need the reasoning model.
+        if has_files or has_images:
+            return "--logic", 0.95
+
+        rule_match = self._match_rule(content)
+        if rule_match is not None:
+            flag, confidence = rule_match
+            if confidence >= self.threshold or not self.trained:
+                return flag, confidence
+
+        if not self.trained:
+            return "--none", 0.0
+
+        probabilities = self._probabilities(IntentClassifier.features(content))
+        flag = max(probabilities, key=probabilities.get)
+
+        # An ambiguous rule that agrees with the model counts as extra evidence.
+        if rule_match is not None and rule_match[0] == flag:
+            return flag, 1 - (1 - probabilities[flag]) * (1 - rule_match[1])
+
+        return flag, probabilities[flag]
+
+    def calibrate_rules(self, examples: list[tuple[str, str]], min_matches: int = 20) -> dict[int, float]:
+        """Sets each rule's confidence to how often Gemini agreed with it on the messages it matched,
+        for rules that matched at least `min_matches` examples. Returns the calibrated confidences."""
+        matches = {}
+        agreements = {}
+        for content, expected in examples:
+            for index, (pattern, flag, _) in enumerate(IntentClassifier._RULES):
+                if pattern.search(content):
+                    matches[index] = matches.get(index, 0) + 1
+                    agreements[index] = agreements.get(index, 0) + (flag == expected)
+                    break
+
+        # Smoothed, so a rule that was right on a handful of messages isn't fully trusted.
+        self._rule_confidences = {index: (agreements[index] + 1) / (count + 2)
+                                  for index, count in matches.items() if count >= min_matches}
+
+        return dict(self._rule_confidences)
+
+    def _match_rule(self, content: str) -> tuple[str, float] | None:
+        for index, (pattern, flag, confidence) in enumerate(IntentClassifier._RULES):
+            if pattern.search(content):
+                return flag, self._rule_confidences.get(index, confidence)
+
+        return None
+
+    def classify(self, content: str, has_files: bool = False, has_images: bool = False) -> str | None:
+        """Returns a flag if the classifier is confident enough, otherwise None."""
+        flag, confidence = self.predict(content, has_files, has_images)
+        if confidence >= self.threshold:
+            return flag
+
+        return None
+
+    def train(self, examples: list[tuple[str, str]], epochs: int = 10,
+              learning_rate: float = 0.5, l2: float = 1e-5, seed: int = 0) -> None:
+        """Fits the linear model with stochastic gradient descent.
+        Each example is a (message content, flag) pair."""
+        dataset = [(IntentClassifier.features(content), flag) for content, flag in examples if flag in FLAGS]
+        rng = random.Random(seed)
+
+        self._weights = {flag: {} for flag in FLAGS}
+        self._bias = {flag: 0.0 for flag in FLAGS}
+
+        for epoch in range(epochs):
+            rng.shuffle(dataset)
+            rate = learning_rate / (1 + epoch)
+
+            for features, label in dataset:
+                probabilities = self._probabilities(features)
+
+                for flag in FLAGS:
+                    gradient = probabilities[flag] - (1.0 if flag == label else 0.0)
+                    flag_weights = self._weights[flag]
+
+                    for index in features:
+                        weight = flag_weights.get(index, 0.0)
+                        flag_weights[index] = weight - rate * (gradient + l2 * weight)
+
+                    self._bias[flag] -= rate * gradient
+
+    def _probabilities(self, features: list[int]) -> dict[str, float]:
+        scores = {}
+        for flag in FLAGS:
+            flag_weights = self._weights.get(flag, {})
+            scores[flag] = self._bias.get(flag, 0.0) + sum(flag_weights.get(index, 0.0) for index in features)
+
+        highest = max(scores.values())
+        exponents = {flag: math.exp(score - highest) for flag, score in scores.items()}
+        total = sum(exponents.values())
+
+        return {flag: exponent / total for flag, exponent in exponents.items()}
+
+
+class RoutingLog:
+    """
+    Appends routing decisions made by Gemini to a JSON lines file, to be used as
+    training and evaluation data for IntentClassifier. Each line has the form:
+
+    {"content": str, "has_files": bool, "has_images": bool, "flag": str, "latency_ms": float, "time": float}
+
+    Shadow decisions (Gemini's flag for a sample of the messages the local
+    classifier routed on its own) also have "local_flag", the classifier's flag,
+    and "sample_rate", the fraction of such messages that were sampled.
+    When Gemini was given more than the message's content (what it replies to,
+    the user's activity), that input is kept as "router_input".
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+    def record(self, content: str, flag: str, latency_ms: float,
+               has_files: bool = False, has_images: bool = False,
+               local_flag: str | None = None, sample_rate: float | None = None,
+               router_input: str | None = None) -> None:
+        entry = {
+            "content": content,
+            "has_files": has_files,
+            "has_images": has_images,
+            "flag": flag.strip(),
+            "latency_ms": latency_ms,
+            "time": time.time(),
+        }
+
+        if local_flag is not None:
+            entry["local_flag"] = local_flag
+            entry["sample_rate"] = sample_rate
+
+        if router_input is not None and router_input != content:
+            entry["router_input"] = router_input
+
+        with open(self.path, "a", encoding="utf-8") as log_file:
+            log_file.write(json.dumps(entry) + "\n")
+
+    @staticmethod
+    def read(path: str) -> list[dict]:
+        with open(path, "r", encoding="utf-8") as log_file:
+            return [json.loads(line) for line in log_file if line.strip()]
@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+import asyncio
+import re
+import typing
+
+from discord import Spotify
+
+from gateways.cache import TTLCache
+
+if typing.TYPE_CHECKING:
+    from gateways.genius_api_gateway import GeniusAPIGateway
+
+# Messages about whatever the user is listening to, which can be answered from their Spotify activity.
+_CURRENT_TRACK_PATTERN = re.compile(
+    r"\b(this (song|track|artist|singer|band)|(song|track) (i'?m|i am) (listening to|playing|on)|"
+    r"what i'?m (listening to|playing)|currently (listening|playing)|listening to (right )?now|"
+    r"who (sings|sang|made|produced) (this|it)|what am i listening to)\b", re.IGNORECASE)
+
+
+def spotify_activity(user: typing.Any) -> Spotify | None:
+    """Returns the user's Spotify activity, if they are listening to something."""
+    for activity in getattr(user, "activities", ()):
+        if isinstance(activity, Spotify):
+            return activity
+
+    return None
+
+
+def refers_to_current_track(content: str) -> bool:
+    """Whether the message asks about the track the user is listening to ("what's this song?")."""
+    return _CURRENT_TRACK_PATTERN.search(content) is not None
+
+
+def _is_fresh(cache: TTLCache, key: typing.Hashable) -> bool:
+    # Checked without get(), so the prefetcher's lookups don't skew the cache's hit rate.
+    age = cache.age(key)
+    return age is not None and age <= cache.ttl
+
+
+class SpotifyPrefetcher:
+    """
+    Warms the Genius cache with the song and artist metadata of the tracks that
+    active users (users who talked to the bot in the last `active_ttl` seconds)
+    are listening to, so that --song and --artist questions about them are
+    answered without any upstream calls.
+
+    Fed from presence updates. Each track is prefetched at most once every
+    `track_ttl` seconds, and at most `concurrency` prefetches run at once;
+    tracks that change while all prefetches are busy are skipped rather than
+    queued, since the user will likely have moved on by the time they'd run.
+    """
+
+    def __init__(self, genius_gateway: GeniusAPIGateway, active_ttl: float = 3600, track_ttl: float = 24 * 3600,
+                 concurrency: int = 4, max_users: int = 10000) -> None:
+        self.genius_gateway = genius_gateway
+        self.concurrency = concurrency
+
+        self._active_users = TTLCache(active_ttl, max_users)
+        self._tracks = TTLCache(track_ttl, max_users)
+        self._tasks: set[asyncio.Task] = set()
+
+        self._prefetched = 0
+        self._skipped = 0
+        self._errors = 0
+
+    def mark_active(self, user_id: int) -> None:
+        self._active_users.set(user_id, True)
+
+    def on_presence_update(self, user: typing.Any) -> None:
+        activity = spotify_activity(user)
+        if activity is None or not _is_fresh(self._active_users, user.id) or not activity.artists:
+            return
+
+        track_id = activity.track_id
+        if _is_fresh(self._tracks, track_id):
+            return
+
+        if len(self._tasks) >= self.concurrency:
+            self._skipped += 1
+            return
+
+        self._tracks.set(track_id, True)
+        task = asyncio.create_task(self._prefetch(activity.title, activity.artists[0]))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _prefetch(self, title: str, artist: str) -> None:
+        try:
+            await asyncio.gather(self.genius_gateway.get_song_info(title, artist),
+                                 self.genius_gateway.get_artist_info(artist))
+            self._prefetched += 1
+        except Exception:
+            self._errors += 1
+
+    async def close(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "in_flight": len(self._tasks),
+            "prefetched": self._prefetched,
+            "skipped": self._skipped,
+            "errors": self._errors,
+        }
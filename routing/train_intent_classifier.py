@@ -0,0 +1,40 @@
+"""
+Trains IntentClassifier from logged Gemini routing decisions (see RoutingLog).
+
+Usage:
+    python -m routing.train_intent_classifier routing_log.jsonl --output intent_model.json
+"""
+from __future__ import annotations
+
+import argparse
+
+from routing.intent_classifier import IntentClassifier
+from routing.intent_classifier import RoutingLog
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Train the local intent classifier from routing logs.")
+    parser.add_argument("logs", nargs="+", help="routing log files (JSON lines)")
+    parser.add_argument("--output", default="intent_model.json", help="where to write the trained model")
+    parser.add_argument("--epochs", type=int, default=10)
+    parser.add_argument("--learning-rate", type=float, default=0.5)
+    parser.add_argument("--min-rule-matches", type=int, default=20,
+                        help="decisions a keyword rule must match before its confidence is calibrated")
+    args = parser.parse_args()
+
+    examples = []
+    for path in args.logs:
+        for entry in RoutingLog.read(path):
+            examples.append((entry["content"], entry["flag"]))
+
+    classifier = IntentClassifier()
+    classifier.train(examples, epochs=args.epochs, learning_rate=args.learning_rate)
+    rule_confidences = classifier.calibrate_rules(examples, args.min_rule_matches)
+    classifier.save(args.output)
+
+    print(f"Trained on {len(examples)} routing decisions, saved to {args.output}")
+    print(f"Calibrated {len(rule_confidences)} of {len(IntentClassifier._RULES)} keyword rules")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+from __future__ import annotations
+
+import json
+import re
+import typing
+
+
+class WakeWordMatcher:
+    """
+    Decides whether a message wakes the bot up, i.e. starts with a greeting
+    followed by one of the bot's aliases ("hey speeb", "good morning speebot", ...).
+
+    Both the aliases and the greetings are compiled into regular expressions once.
+    A greeting's words are matched exactly, except for "*", which matches any one
+    word (so "good *" matches "good morning" and "good evening"). The word after
+    the greeting matches if it contains an alias.
+
+    Messages are matched the way they always have been: case-insensitively, with
+    every character that isn't alphanumeric or a space removed. That normalization
+    only happens for messages containing an alias, so most messages are rejected by
+    a single search that doesn't allocate anything.
+    """
+
+    aliases: tuple[str, ...]
+    greetings: tuple[str, ...]
+
+    def __init__(self, aliases: typing.Iterable[str], greetings: typing.Iterable[str]) -> None:
+        self.aliases = tuple(alias.lower() for alias in aliases)
+        self.greetings = tuple(greeting.lower() for greeting in greetings)
+
+        # Longest first, so that e.g. "heya" isn't cut short by "hey".
+        alias_pattern = "|".join(re.escape(alias) for alias in sorted(self.aliases, key=len, reverse=True))
+        greeting_pattern = "|".join(
+            " ".join("[^ ]*" if word == "*" else re.escape(word) for word in greeting.split())
+            for greeting in sorted(self.greetings, key=len, reverse=True)
+        )
+
+        self._candidate = re.compile(alias_pattern, re.IGNORECASE)
+        self._wake_up = re.compile(f"(?:{greeting_pattern}) [^ ]*(?:{alias_pattern})")
+
+    def matches(self, content: str) -> bool:
+        if self._candidate.search(content) is None:
+            return False
+
+        normalized = ''.join(char.lower() if char.isalnum() or char == ' ' else '' for char in content)
+        return self._wake_up.match(normalized) is not None
+
+
+class WakeWords:
+    """
+    The wake word matchers for each guild, falling back to a default matcher for
+    guilds without their own aliases and greetings.
+
+    Can be loaded from a JSON file of the form:
+
+    {"guilds": {"<guild id>": {"aliases": [...], "greetings": [...]}}}
+
+    where a guild without "aliases" or "greetings" uses the default ones.
+    """
+
+    def __init__(self, default: WakeWordMatcher, guilds: dict[int, WakeWordMatcher] | None = None) -> None:
+        self.default = default
+        self._guilds = guilds if guilds is not None else {}
+
+    @classmethod
+    def load(cls, path: str, aliases: typing.Iterable[str], greetings: typing.Iterable[str]) -> WakeWords:
+        with open(path, "r", encoding="utf-8") as config_file:
+            config = json.load(config_file)
+
+        default = WakeWordMatcher(aliases, greetings)
+
+        guilds = {}
+        for guild_id, guild_config in config.get("guilds", {}).items():
+            guilds[int(guild_id)] = WakeWordMatcher(guild_config.get("aliases", default.aliases),
+                                                    guild_config.get("greetings", default.greetings))
+
+        return cls(default, guilds)
+
+    def for_guild(self, guild_id: int | None) -> WakeWordMatcher:
+        return self._guilds.get(guild_id, self.default)
+
+    def matches(self, content: str, guild_id: int | None = None) -> bool:
+        return self.for_guild(guild_id).matches(content)
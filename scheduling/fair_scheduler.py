@@ -0,0 +1,235 @@
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import heapq
+import itertools
+import time
+import typing
+from collections import Counter
+from collections import OrderedDict
+from collections import defaultdict
+from collections import deque
+
+
+class SchedulerOverloaded(Exception):
+    """Raised when a request can't be queued because its queue is full."""
+    pass
+
+
+class _GuildStats:
+    __slots__ = ("dispatched", "shed", "wait_total", "wait_max")
+
+    def __init__(self) -> None:
+        self.dispatched = 0
+        self.shed = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+
+class FairScheduler:
+    """
+    Limits how many requests run at once, and decides which waiting request
+    runs next.
+
+    Waiting requests are ordered by priority first (lower runs first, e.g.
+    replies to existing conversations before new wake-ups), then by weighted
+    fair queuing: each guild gets a share of the slots proportional to its
+    weight, split evenly between the users of that guild with requests waiting.
+    A single busy channel therefore can't starve the other guilds.
+
+    Requests are rejected with SchedulerOverloaded once a user has
+    `max_queue_per_user` requests waiting, or `max_queued` requests are waiting
+    in total.
+
+    Dispatch, shedding and wait statistics are kept per guild for the
+    `max_tracked_guilds` most recently active guilds only, alongside totals
+    over all guilds.
+    """
+
+    _MAX_CONCURRENCY: int
+    _MAX_QUEUE_PER_USER: int
+    _MAX_QUEUED: int
+
+    def __init__(self, max_concurrency: int = 8, max_queue_per_user: int = 3, max_queued: int = 100,
+                 guild_weights: dict[int, float] | None = None, default_weight: float = 1.0,
+                 max_tracked_guilds: int = 1000) -> None:
+        self._MAX_CONCURRENCY = max_concurrency
+        self._MAX_QUEUE_PER_USER = max_queue_per_user
+        self._MAX_QUEUED = max_queued
+        self._guild_weights = guild_weights if guild_weights is not None else {}
+        self._default_weight = default_weight
+        self._max_tracked_guilds = max_tracked_guilds
+
+        self._running = 0
+        self._virtual_time = 0.0
+        self._sequence = itertools.count()
+
+        # (priority, virtual finish time, sequence, future, guild, user, enqueued at)
+        self._queue: list[tuple[int, float, int, asyncio.Future, typing.Hashable, typing.Hashable, float]] = []
+        self._last_finish: dict[tuple[typing.Hashable, typing.Hashable], float] = {}
+
+        self._guild_depth = Counter()
+        self._user_depth = Counter()
+        self._guild_users: dict[typing.Hashable, Counter] = defaultdict(Counter)
+
+        # Least recently active guild first.
+        self._guild_stats: OrderedDict[typing.Hashable, _GuildStats] = OrderedDict()
+        self._dispatched = 0
+        self._shed = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._recent_waits: deque[float] = deque(maxlen=1000)
+
+    @contextlib.asynccontextmanager
+    async def slot(self, guild: typing.Hashable, user: typing.Hashable,
+                   priority: int = 0) -> typing.AsyncIterator[None]:
+        """Waits for a slot (raising SchedulerOverloaded if the request can't be queued),
+        and holds it for the duration of the block."""
+        await self.acquire(guild, user, priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def acquire(self, guild: typing.Hashable, user: typing.Hashable, priority: int = 0) -> None:
+        if self._running < self._MAX_CONCURRENCY and not self._queue:
+            self._running += 1
+            self._record_wait(guild, 0.0)
+            return
+
+        if self._user_depth[(guild, user)] >= self._MAX_QUEUE_PER_USER or len(self._queue) >= self._MAX_QUEUED:
+            self._shed += 1
+            self._stats_for(guild).shed += 1
+            raise SchedulerOverloaded(f"Queue full for user {user} in guild {guild}")
+
+        future = asyncio.get_running_loop().create_future()
+        enqueued_at = time.monotonic()
+        self._enqueue(priority, future, guild, user, enqueued_at)
+
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was handed over just as the request was cancelled.
+                self.release()
+            else:
+                self._remove(future)
+            raise
+
+        self._record_wait(guild, time.monotonic() - enqueued_at)
+
+    def release(self) -> None:
+        self._running -= 1
+
+        while self._queue and self._running < self._MAX_CONCURRENCY:
+            _, finish, _, future, guild, user, _ = heapq.heappop(self._queue)
+            self._dequeued(guild, user)
+
+            # The waiting task was cancelled, but hasn't removed itself from the queue yet.
+            if future.cancelled():
+                continue
+
+            self._virtual_time = max(self._virtual_time, finish)
+            self._running += 1
+            future.set_result(None)
+
+    def stats(self, per_guild: bool = True) -> dict[str, typing.Any]:
+        """Returns the scheduler's state and totals, and with `per_guild`, their breakdown by guild."""
+        waits = sorted(self._recent_waits)
+
+        def percentile(fraction: float) -> float:
+            if not waits:
+                return 0.0
+            return waits[min(int(len(waits) * fraction), len(waits) - 1)]
+
+        stats = {
+            "running": self._running,
+            "queued": len(self._queue),
+            "max_concurrency": self._MAX_CONCURRENCY,
+            "dispatched": self._dispatched,
+            "shed": self._shed,
+            "mean_wait": self._wait_total / self._dispatched if self._dispatched else 0.0,
+            "max_wait": self._wait_max,
+            "wait_p50": percentile(0.5),
+            "wait_p95": percentile(0.95),
+        }
+        if per_guild:
+            guilds = self._guild_stats.items()
+            stats.update({
+                "guild_queue_depth": dict(self._guild_depth),
+                "guild_dispatched": {guild: entry.dispatched for guild, entry in guilds},
+                "guild_shed": {guild: entry.shed for guild, entry in guilds},
+                "guild_mean_wait": {guild: entry.wait_total / entry.dispatched
+                                    for guild, entry in guilds if entry.dispatched},
+                "guild_max_wait": {guild: entry.wait_max for guild, entry in guilds},
+            })
+
+        return stats
+
+    # helper functions
+
+    def _weight(self, guild: typing.Hashable) -> float:
+        # A guild's weight is split between its users with requests waiting.
+        return self._guild_weights.get(guild, self._default_weight) / max(len(self._guild_users[guild]), 1)
+
+    def _enqueue(self, priority: int, future: asyncio.Future, guild: typing.Hashable,
+                 user: typing.Hashable, enqueued_at: float) -> None:
+        self._guild_depth[guild] += 1
+        self._user_depth[(guild, user)] += 1
+        self._guild_users[guild][user] += 1
+
+        flow = (guild, user)
+        finish = max(self._virtual_time, self._last_finish.get(flow, 0.0)) + 1 / self._weight(guild)
+        self._last_finish[flow] = finish
+
+        heapq.heappush(self._queue, (priority, finish, next(self._sequence), future, guild, user, enqueued_at))
+
+    def _remove(self, future: asyncio.Future) -> None:
+        for index, entry in enumerate(self._queue):
+            if entry[3] is future:
+                self._queue[index] = self._queue[-1]
+                self._queue.pop()
+                heapq.heapify(self._queue)
+                self._dequeued(entry[4], entry[5])
+                return
+
+    def _dequeued(self, guild: typing.Hashable, user: typing.Hashable) -> None:
+        self._guild_depth[guild] -= 1
+        if self._guild_depth[guild] == 0:
+            del self._guild_depth[guild]
+
+        # Once a user has nothing waiting, their finish time no longer matters.
+        self._user_depth[(guild, user)] -= 1
+        if self._user_depth[(guild, user)] == 0:
+            del self._user_depth[(guild, user)]
+            self._last_finish.pop((guild, user), None)
+
+        users = self._guild_users[guild]
+        users[user] -= 1
+        if users[user] == 0:
+            del users[user]
+        if not users:
+            del self._guild_users[guild]
+
+    def _stats_for(self, guild: typing.Hashable) -> _GuildStats:
+        entry = self._guild_stats.get(guild)
+        if entry is None:
+            entry = self._guild_stats[guild] = _GuildStats()
+            if len(self._guild_stats) > self._max_tracked_guilds:
+                self._guild_stats.popitem(last=False)
+        else:
+            self._guild_stats.move_to_end(guild)
+
+        return entry
+
+    def _record_wait(self, guild: typing.Hashable, wait: float) -> None:
+        self._dispatched += 1
+        self._wait_total += wait
+        self._wait_max = max(self._wait_max, wait)
+        self._recent_waits.append(wait)
+
+        entry = self._stats_for(guild)
+        entry.dispatched += 1
+        entry.wait_total += wait
+        entry.wait_max = max(entry.wait_max, wait)
@@ -0,0 +1,223 @@
+"""
+Runs the bot as several worker processes, each owning a subset of the bot's
+Discord shards (so each worker's event loop, executor and conversations only
+deal with its own guilds, and throughput scales with the number of cores).
+
+The supervisor starts the workers (staggered, so their shards don't identify
+with Discord at the same time), restarts them with exponential backoff when
+they exit, and serves the metrics of every worker at METRICS_PORT, each series
+labelled with the worker it came from. Worker i serves its own metrics at
+METRICS_PORT + 1 + i.
+
+Usage:
+    python -m sharding.supervisor [--workers 4] [--shards 8] [--metrics-port 9464]
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import signal
+import sys
+import time
+from pathlib import Path
+
+import httpx
+
+from metrics.server import MetricsServer
+
+_MAIN = Path(__file__).resolve().parent.parent / "main.py"
+
+
+class Worker:
+    """A worker process running `shard_ids` out of `shard_count` shards, restarted whenever it exits."""
+
+    # Restarts back off exponentially, unless the worker had been running for at least _STABLE_AFTER seconds.
+    _MIN_BACKOFF = 1.0
+    _MAX_BACKOFF = 60.0
+    _STABLE_AFTER = 300.0
+
+    def __init__(self, index: int, shard_ids: list[int], shard_count: int, metrics_port: int,
+                 command: list[str] | None = None) -> None:
+        self.index = index
+        self.shard_ids = shard_ids
+        self.shard_count = shard_count
+        self.metrics_port = metrics_port
+        self.command = command if command is not None else [sys.executable, str(_MAIN)]
+
+        self.process: asyncio.subprocess.Process | None = None
+        self.restarts = 0
+        self._backoff = Worker._MIN_BACKOFF
+
+    @property
+    def running(self) -> bool:
+        return self.process is not None and self.process.returncode is None
+
+    def environment(self) -> dict[str, str]:
+        return {
+            **os.environ,
+            "SHARD_COUNT": str(self.shard_count),
+            "SHARD_IDS": ",".join(str(shard_id) for shard_id in self.shard_ids),
+            "METRICS_HOST": "127.0.0.1",
+            "METRICS_PORT": str(self.metrics_port),
+        }
+
+    async def run(self, stopping: asyncio.Event) -> None:
+        while not stopping.is_set():
+            started_at = time.monotonic()
+            self.process = await asyncio.create_subprocess_exec(*self.command, env=self.environment())
+            print(f"Worker {self.index} started (pid {self.process.pid}, shards {self.shard_ids})")
+
+            return_code = await self.process.wait()
+            if stopping.is_set():
+                break
+
+            if time.monotonic() - started_at >= Worker._STABLE_AFTER:
+                self._backoff = Worker._MIN_BACKOFF
+
+            print(f"Worker {self.index} exited with code {return_code}, restarting in {self._backoff:.0f}s")
+            self.restarts += 1
+
+            try:
+                await asyncio.wait_for(stopping.wait(), self._backoff)
+            except asyncio.TimeoutError:
+                pass
+
+            self._backoff = min(self._backoff * 2, Worker._MAX_BACKOFF)
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        if not self.running:
+            return
+
+        self.process.terminate()
+        try:
+            await asyncio.wait_for(self.process.wait(), timeout)
+        except asyncio.TimeoutError:
+            self.process.kill()
+            await self.process.wait()
+
+
+def assign_shards(shard_count: int, workers: int) -> list[list[int]]:
+    """Splits the shards between the workers as evenly as possible."""
+    return [list(range(index, shard_count, workers)) for index in range(workers)]
+
+
+class Supervisor:
+    def __init__(self, workers: list[Worker], start_interval: float) -> None:
+        self.workers = workers
+        self.start_interval = start_interval
+        self._stopping = asyncio.Event()
+        self._http = httpx.AsyncClient(timeout=2.0)
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        for signal_number in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signal_number, self._stopping.set)
+
+        tasks = []
+        for worker in self.workers:
+            if self._stopping.is_set():
+                break
+
+            tasks.append(asyncio.create_task(worker.run(self._stopping)))
+
+            # Only one shard can identify with Discord at a time (about every 5 seconds).
+            try:
+                await asyncio.wait_for(self._stopping.wait(), self.start_interval)
+            except asyncio.TimeoutError:
+                pass
+
+        await self._stopping.wait()
+        print("Stopping workers...")
+
+        await asyncio.gather(*(worker.stop() for worker in self.workers))
+        await asyncio.gather(*tasks)
+        await self._http.aclose()
+
+    async def render(self) -> str:
+        """Collects the metrics of every worker, labelling each series with its worker."""
+        responses = await asyncio.gather(*(self._http.get(f"http://127.0.0.1:{worker.metrics_port}/metrics")
+                                           for worker in self.workers), return_exceptions=True)
+
+        # metric family -> (HELP and TYPE lines, samples), so each family's samples stay together.
+        families: dict[str, tuple[list[str], list[str]]] = {}
+
+        for worker, response in zip(self.workers, responses):
+            if isinstance(response, BaseException) or response.status_code != 200:
+                continue
+
+            family = ""
+            for line in response.text.splitlines():
+                if line.startswith("#"):
+                    family = line.split()[2]
+                    headers, _ = families.setdefault(family, ([], []))
+                    if len(headers) < 2:
+                        headers.append(line)
+                elif line:
+                    families.setdefault(family, ([], []))[1].append(add_label(line, "worker", worker.index))
+
+        lines = ["# HELP speebgpt_worker_up Whether the worker process is running.",
+                 "# TYPE speebgpt_worker_up gauge"]
+        lines.extend(f'speebgpt_worker_up{{worker="{worker.index}"}} {int(worker.running)}' for worker in self.workers)
+        lines.extend(["# HELP speebgpt_worker_restarts Number of times the worker process was restarted.",
+                      "# TYPE speebgpt_worker_restarts counter"])
+        lines.extend(f'speebgpt_worker_restarts{{worker="{worker.index}"}} {worker.restarts}'
+                     for worker in self.workers)
+
+        for headers, samples in families.values():
+            lines.extend(headers)
+            lines.extend(samples)
+
+        return "\n".join(lines) + "\n"
+
+
+def add_label(sample: str, name: str, value: object) -> str:
+    """Adds a label to a sample line of the Prometheus text format."""
+    label = f'{name}="{value}"'
+    end_of_name = min(index for index in (sample.find("{"), sample.find(" "), len(sample)) if index != -1)
+
+    if sample[end_of_name:end_of_name + 1] == "{":
+        separator = "" if sample[end_of_name + 1] == "}" else ","
+        return f"{sample[:end_of_name + 1]}{label}{separator}{sample[end_of_name + 1:]}"
+
+    return f"{sample[:end_of_name]}{{{label}}}{sample[end_of_name:]}"
+
+
+async def supervise(args: argparse.Namespace) -> None:
+    shard_count = args.shards if args.shards is not None else args.workers
+
+    workers = [Worker(index, shard_ids, shard_count, args.metrics_port + 1 + index)
+               for index, shard_ids in enumerate(assign_shards(shard_count, args.workers))]
+
+    start_interval = args.start_interval
+    if start_interval is None:
+        start_interval = 5.0 * max(len(worker.shard_ids) for worker in workers)
+
+    supervisor = Supervisor(workers, start_interval)
+    metrics_server = MetricsServer(supervisor, args.metrics_host, args.metrics_port)
+    await metrics_server.start()
+
+    try:
+        await supervisor.run()
+    finally:
+        await metrics_server.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run the bot as several sharded worker processes.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--shards", type=int, default=None, help="total number of shards (defaults to --workers)")
+    parser.add_argument("--metrics-host", default=os.getenv("METRICS_HOST", "127.0.0.1"))
+    parser.add_argument("--metrics-port", type=int, default=int(os.getenv("METRICS_PORT", 9464)))
+    parser.add_argument("--start-interval", type=float, default=None,
+                        help="seconds between worker starts (defaults to 5 seconds per shard of a worker)")
+    args = parser.parse_args()
+
+    if args.shards is not None and args.shards < args.workers:
+        parser.error("--shards must be at least --workers")
+
+    asyncio.run(supervise(args))
+
+
+if __name__ == "__main__":
+    main()